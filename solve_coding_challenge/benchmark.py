@@ -0,0 +1,310 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+import numpy as np
+import pandas as pd
+
+from utils.load_csv import loadcsv
+from utils.tsp import solvetsp
+from utils.lin_kernighan import solvelk
+from utils.instrumentation import solver_stats
+from utils.kernels import get_kernels
+
+# Solver modes: keyword arguments of solvetsp.solve_opt2 and the largest size the mode is run for
+MODES = {
+    "2opt": {"kwargs": {}, "max_size": 2000},
+    "2opt-numba": {"kwargs": {"kernel": "numba"}, "max_size": 2000},
+    "2opt-k10": {"kwargs": {"neighbors": 10}, "max_size": None},
+    "oropt-k10": {"kwargs": {"neighbors": 10, "operators": ["2opt", "oropt"]}, "max_size": None},
+    "3opt-k10": {"kwargs": {"neighbors": 10, "operators": ["2opt", "oropt", "3opt"]}, "max_size": None},
+    "greedy-2opt-k10": {"kwargs": {"neighbors": 10}, "init": "greedy", "max_size": None},
+    "lk-k10": {"kwargs": {"neighbors": 10}, "solver": "lk", "max_size": None},
+}
+DEFAULT_SIZES = [20, 200, 2000]
+LAT_RANGE = (47.3, 55.0)  # Bounding box of Germany
+LON_RANGE = (5.9, 15.0)
+CHECK_KERNELS = {"numba": None, "python": 200}  # Kernels compared with NumPy by --check_kernels and their largest size
+
+
+def get_args():
+    """
+    Setup possible arguments for command line execution.
+
+    :return:
+    parser object
+    """
+    parser = argparse.ArgumentParser(description='Benchmark the distance calculation and the solver modes on seeded '
+                                                 'synthetic site lists.',
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+    parser.add_argument('-n', '--sizes', dest='sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='Numbers of sites of the synthetic site lists (e.g. 20 200 2000 20000)')
+    parser.add_argument('--modes', dest='modes', nargs='+', default=list(MODES), choices=list(MODES),
+                        help='Solver modes to benchmark')
+    parser.add_argument('--seed', dest='seed', type=int, default=0,
+                        help='Seed of the site generator and the initial routes')
+    parser.add_argument('-r', '--repeat', dest='repeat', type=int, default=1,
+                        help='Number of timed runs per benchmark, the fastest one is reported')
+    parser.add_argument('--no_memory', dest='no_memory', default=False, action="store_true",
+                        help='Skip the additional run under tracemalloc which measures the peak memory')
+    parser.add_argument('--dtype', dest='dtype', type=str, default='float64', choices=['float64', 'float32'],
+                        help='Data type of the distance matrix')
+    parser.add_argument('-o', '--output', dest='output', type=str, default=False,
+                        help='Write the results as JSON to the given file')
+    parser.add_argument('--compare', dest='compare', type=str, default=False,
+                        help='Compare the results with a JSON file of a previous run and fail on regressions')
+    parser.add_argument('--check_kernels', dest='check_kernels', default=False, action="store_true",
+                        help='Instead of benchmarking, check that the kernels of utils.kernels (numba if installed, '
+                             'and the uncompiled loops up to 200 sites) compute the same distance matrix and the same '
+                             '2-opt sweeps as NumPy')
+    parser.add_argument('--tolerance', dest='tolerance', type=float, default=0.25,
+                        help='Allowed relative increase of wall time and tour length before a regression is reported')
+    return parser.parse_args()
+
+
+def generate_sites(size: int,
+                   seed: int) -> pd.DataFrame:
+    """
+    Generates a synthetic site list in the format of the csv-file, with sites uniformly distributed over Germany.
+    :param size: int
+        Number of sites
+    :param seed: int
+    :return:
+    dataframe
+    """
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({"Nummer": np.arange(1, size + 1),
+                         "msg Standort": ["Site {i}".format(i=i) for i in range(size)],
+                         "Breitengrad": rng.uniform(*LAT_RANGE, size),
+                         "Längengrad": rng.uniform(*LON_RANGE, size)})
+
+
+def measure(function,
+            repeat: int,
+            memory: bool = True,
+            warmup: bool = False) -> dict:
+    """
+    Runs the given function repeat times for the wall time and once more under tracemalloc for the peak memory.
+    :param function: function without arguments
+    :param repeat: int
+    :param memory: bool
+        Measure the peak memory
+    :param warmup: bool
+        Run the function once untimed before, so that the compilation of the numba kernels is not measured
+    :return:
+    dict with the wall time in seconds, the peak memory in bytes and the result of the last call
+    """
+    if warmup:
+        function()
+    wall_time = np.inf
+    for _ in range(max(repeat, 1)):
+        start = time.perf_counter()
+        result = function()
+        wall_time = min(wall_time, time.perf_counter() - start)
+
+    peak_memory = None
+    if memory:
+        tracemalloc.start()
+        function()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    return {"wall_time": wall_time, "peak_memory": peak_memory, "result": result}
+
+
+def benchmark_loader(path: str,
+                     dtype: str,
+                     repeat: int,
+                     memory: bool,
+                     read_chunk_size: int = None,
+                     kernel: str = "numpy") -> tuple:
+    """
+    Benchmarks loadcsv on the given csv-file, streaming it in chunks if read_chunk_size is set.
+    :return:
+    record: dict
+    distance matrix: array
+    """
+    run = measure(lambda: loadcsv(path, dtype=dtype, read_chunk_size=read_chunk_size, kernel=kernel).get_data()[1],
+                  repeat, memory, warmup=kernel != "numpy")
+    return {"wall_time": run["wall_time"], "peak_memory": run["peak_memory"]}, run["result"]
+
+
+def benchmark_solver(dist_matrix: np.ndarray,
+                     mode: str,
+                     seed: int,
+                     repeat: int,
+                     memory: bool) -> dict:
+    """
+    Benchmarks one iteration of solvetsp.solve_opt2 in the given mode from a seeded initial route (random or built with
+    the construction heuristic of the mode).
+    :return:
+    record: dict
+    """
+    def solve():
+        random.seed(seed)
+        if MODES[mode].get("solver") == "lk":
+            tspsolver = solvelk(dist_matrix)
+            tspsolver.set_init(rand=True, method=MODES[mode].get("init"))
+            tspsolver.solve_lk(scorethresh=0.00001, iterations=1, history="accepted", stats=solver_stats(),
+                               **MODES[mode]["kwargs"])
+        else:
+            tspsolver = solvetsp(dist_matrix)
+            tspsolver.set_init(rand=True, method=MODES[mode].get("init"))
+            tspsolver.solve_opt2(scorethresh=0.00001, iterations=1, history="accepted", stats=solver_stats(),
+                                 **MODES[mode]["kwargs"])
+        return tspsolver
+
+    run = measure(solve, repeat, memory, warmup="kernel" in MODES[mode]["kwargs"])
+    tspsolver = run["result"]
+    stats = tspsolver.get_stats()
+    return {"wall_time": run["wall_time"],
+            "peak_memory": run["peak_memory"],
+            "evaluated_moves": stats.moves_evaluated,
+            "accepted_moves": stats.moves_accepted,
+            "sweeps": len(stats.sweep_times),
+            "moves_per_second": stats.moves_evaluated / run["wall_time"] if run["wall_time"] else None,
+            "tour_length": float(tspsolver.get_result()[1])}
+
+
+def run_benchmarks(sizes: list,
+                   modes: list,
+                   seed: int,
+                   repeat: int,
+                   dtype: str,
+                   memory: bool = True) -> list:
+    """
+    Runs the loader and all solver modes for every size.
+    :return:
+    records: list [dict]
+    """
+    records = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, "sites_{n}.csv".format(n=size))
+            generate_sites(size, seed).to_csv(path, index=False)
+
+            record, dist_matrix = benchmark_loader(path, dtype, repeat, memory)
+            records.append(dict(benchmark="loader", mode="haversine-" + dtype, size=size, **record))
+            logging.warning("loader  {n:>6}: {t:.4f} s".format(n=size, t=record["wall_time"]))
+            record = benchmark_loader(path, dtype, repeat, memory, read_chunk_size=100000)[0]
+            records.append(dict(benchmark="loader", mode="stream-haversine-" + dtype, size=size, **record))
+            logging.warning("stream  {n:>6}: {t:.4f} s".format(n=size, t=record["wall_time"]))
+            if get_kernels("numba") is not None:
+                record = benchmark_loader(path, dtype, repeat, memory, kernel="numba")[0]
+                records.append(dict(benchmark="loader", mode="numba-haversine-" + dtype, size=size, **record))
+                logging.warning("numba   {n:>6}: {t:.4f} s".format(n=size, t=record["wall_time"]))
+
+            for mode in modes:
+                max_size = MODES[mode]["max_size"]
+                if max_size is not None and size > max_size:
+                    continue
+                record = benchmark_solver(dist_matrix, mode, seed, repeat, memory)
+                records.append(dict(benchmark="solver", mode=mode, size=size, **record))
+                logging.warning("{m:<9} {n:>5}: {t:.4f} s, tour length {l:.2f}".format(
+                    m=mode, n=size, t=record["wall_time"], l=record["tour_length"]))
+            del dist_matrix
+    return records
+
+
+def check_kernels(sizes: list,
+                  seed: int,
+                  dtype: str) -> list:
+    """
+    Compares the kernels of CHECK_KERNELS with the NumPy code on seeded synthetic site lists. The distance matrices have
+    to agree up to rounding, and one iteration of full 2-opt sweeps from the same initial route on the same matrix has
+    to apply the same moves (same sequence, total distance and numbers of evaluated and accepted moves). Kernels which
+    are not installed are skipped.
+    :return:
+    failures: list [str]
+        Descriptions of all differences
+    """
+    def solve(dist_matrix, kernel):
+        random.seed(seed)
+        stats = solver_stats()
+        tspsolver = solvetsp(dist_matrix)
+        tspsolver.set_init(rand=True)
+        tspsolver.solve_opt2(scorethresh=0.00001, iterations=1, history="accepted", stats=stats, kernel=kernel)
+        sequence, dist = tspsolver.get_result()
+        return list(sequence), float(dist), stats.moves_evaluated, stats.moves_accepted
+
+    rtol = 1e-5 if dtype == "float32" else 1e-12
+    failures = []
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            path = os.path.join(directory, "sites_{n}.csv".format(n=size))
+            generate_sites(size, seed).to_csv(path, index=False)
+            dist_matrix = loadcsv(path, dtype=dtype).get_data()[1]
+            expected = solve(dist_matrix, "numpy")
+            for kernel, max_size in CHECK_KERNELS.items():
+                if get_kernels(kernel) is None or (max_size is not None and size > max_size):
+                    continue
+                matrix = loadcsv(path, dtype=dtype, kernel=kernel).get_data()[1]
+                if not np.allclose(matrix, dist_matrix, rtol=rtol, atol=0):
+                    failures.append("{k} {n}: distance matrix differs by up to {e:.3g} km".format(
+                        k=kernel, n=size, e=float(np.max(np.abs(matrix - dist_matrix)))))
+                result = solve(dist_matrix, kernel)
+                if result != expected:
+                    failures.append("{k} {n}: 2-opt sweeps differ (distance {d}, evaluated {e}, accepted {a} instead "
+                                    "of {d0}, {e0}, {a0})".format(k=kernel, n=size, d=result[1], e=result[2],
+                                                                  a=result[3], d0=expected[1], e0=expected[2],
+                                                                  a0=expected[3]))
+                logging.warning("{k:<7} {n:>6}: checked".format(k=kernel, n=size))
+    return failures
+
+
+def compare_results(records: list,
+                    previous: list,
+                    tolerance: float) -> list:
+    """
+    Compares the records with those of a previous run.
+    :return:
+    regressions: list [str]
+        Descriptions of all wall times and tour lengths which increased by more than the tolerance
+    """
+    previous = {(r["benchmark"], r["mode"], r["size"]): r for r in previous}
+    regressions = []
+    for record in records:
+        old = previous.get((record["benchmark"], record["mode"], record["size"]))
+        if old is None:
+            continue
+        for key in ("wall_time", "tour_length"):
+            if key in record and old.get(key) and record[key] > old[key] * (1 + tolerance):
+                regressions.append("{b} {m} {n}: {k} {o:.4f} -> {v:.4f}".format(
+                    b=record["benchmark"], m=record["mode"], n=record["size"], k=key, o=old[key], v=record[key]))
+    return regressions
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING, format="%(message)s")
+    args = get_args()
+
+    if args.check_kernels:
+        failures = check_kernels(args.sizes, args.seed, args.dtype)
+        for failure in failures:
+            print("Difference: " + failure)
+        sys.exit(1 if failures else 0)
+
+    records = run_benchmarks(args.sizes, args.modes, args.seed, args.repeat, args.dtype, not args.no_memory)
+    results = {"python": sys.version.split()[0],
+               "numpy": np.__version__,
+               "platform": platform.platform(),
+               "seed": args.seed,
+               "results": records}
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump(results, fh, indent=2)
+        print("Results written to {p}".format(p=args.output))
+
+    if args.compare:
+        with open(args.compare) as fh:
+            regressions = compare_results(records, json.load(fh)["results"], args.tolerance)
+        for regression in regressions:
+            print("Regression: " + regression)
+        if regressions:
+            sys.exit(1)
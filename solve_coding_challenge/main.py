@@ -1,9 +1,18 @@
 import logging
 import argparse
+import sys
 
 from utils.load_csv import loadcsv
 from utils.tsp import solvetsp
-from utils.visualization import visualize_map, visualize_graph
+from utils.lin_kernighan import solvelk
+from utils.construction import CONSTRUCTIONS
+from utils.operators import OPERATORS
+from utils.history import solution_history
+from utils.instrumentation import solver_stats, profiling, PROFILERS
+from utils.distance_cache import distance_cache, DEFAULT_CACHE_DIR
+from utils.kernels import KERNELS
+# utils.batch, utils.service and utils.export (with pandas, plotly and ipyleaflet) are only imported when they are
+# used, so the start of the program stays fast
 
 def get_args():
     """
@@ -18,45 +27,117 @@ def get_args():
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
     parser.add_argument('-l', '--load', dest='load', type=str, default=False,
                         help='Load CSV-File in the stated form')
+    parser.add_argument('-c', '--cache', dest='cache', type=str, nargs='?', default=False, const=DEFAULT_CACHE_DIR,
+                        help='[OPTIONAL] Cache the distance matrix in the given directory (default directory if no '
+                             'directory is given).')
+    parser.add_argument('--cache_size', dest='cache_size', type=int, default=1024,
+                        help='[OPTIONAL] Set the maximum size of the distance matrix cache in MB.')
+    parser.add_argument('--stream', dest='stream', type=int, nargs='?', default=0, const=100000,
+                        help='[OPTIONAL] Stream the CSV-File in chunks of the given number of rows and keep only the '
+                             'names and coordinates (100000 rows if no number is given).')
+    parser.add_argument('--sparse', dest='sparse', type=int, default=0,
+                        help='[OPTIONAL] Keep only the given number of nearest neighbours of each city instead of the '
+                             'full distance matrix and calculate all other distances on demand (for very large '
+                             'CSV-Files).')
+    parser.add_argument('-b', '--batch', dest='batch', type=str, nargs='?', default=None, const='',
+                        help='[OPTIONAL] Solve many small instances at once: every CSV-File of the directory given '
+                             'with -l, or the groups of the given column of the CSV-File. The first city of each '
+                             'instance is its start and end.')
+    parser.add_argument('--batch_size', dest='batch_size', type=int, default=256,
+                        help='[OPTIONAL] Set the number of instances solved at once in batch mode.')
+    parser.add_argument('--serve', dest='serve', type=str, nargs='?', default=None, const='8000',
+                        help='[OPTIONAL] Run as local solver service on the given port, or Unix socket if a path is '
+                             'given (port 8000 if nothing is given): POST /solve with a JSON object like '
+                             '{"sites": [0, 3, 7], "time_limit": 1, "seed": 1}. The CSV-File of -l and the other '
+                             'options are the defaults of the requests, -j sets the number of worker processes.')
+    parser.add_argument('--sites', dest='sites', type=int, nargs='+', default=None,
+                        help='[OPTIONAL] Visit only the cities with the given numbers (rows of the CSV-File), with the '
+                             'distances taken from the matrix of all cities.')
+    parser.add_argument('--depot', dest='depot', type=int, default=0,
+                        help='[OPTIONAL] Set the number of the city at start and end of the route.')
     parser.add_argument('-i', '--iterations', dest='iterations', type=int, default=False,
                         help='[OPTIONAL] Set the wanted iterations with random initial routes for the algorithm')
+    parser.add_argument('--init', dest='init', type=str, default=CONSTRUCTIONS[0], choices=CONSTRUCTIONS,
+                        help='[OPTIONAL] Set the construction heuristic for the initial routes of the iterations.')
+    parser.add_argument('--restart', dest='restart', type=str, default=solvetsp.RESTARTS[0], choices=solvetsp.RESTARTS,
+                        help='[OPTIONAL] Set how the iterations after the first one start: from a new initial route, '
+                             'or from the current route perturbed by a double-bridge kick (iterated local search).')
+    parser.add_argument('--solver', dest='solver', type=str, default='2opt', choices=['2opt', 'lk'],
+                        help='[OPTIONAL] Set the solver: 2-opt with the operators of -o, or a Lin-Kernighan style '
+                             'search with chains of 2-opt moves and Or-opt.')
     parser.add_argument('-s', '--score', dest='score', type=float, default=False,
                         help='[OPTIONAL] Set score, where the algorithms ends the optimization.')
+    parser.add_argument('-t', '--time_limit', dest='time_limit', type=float, default=None,
+                        help='[OPTIONAL] Stop the optimization after the given number of seconds and return the best '
+                             'route found so far (later iterations only get the time left over).')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1,
+                        help='[OPTIONAL] Set the number of processes running the iterations in parallel '
+                             '(0 uses all CPU cores).')
+    parser.add_argument('--kernel', dest='kernel', type=str, default=KERNELS[0], choices=KERNELS[:2],
+                        help='[OPTIONAL] Set the backend of the distance matrix and the full 2-opt sweeps: NumPy, or '
+                             'loops compiled with numba (NumPy is used if numba is not installed).')
+    parser.add_argument('-k', '--neighbors', dest='neighbors', type=int, default=0,
+                        help='[OPTIONAL] Restrict the moves to the k nearest neighbours of each city '
+                             '(0 evaluates all pairs).')
+    parser.add_argument('-o', '--operators', dest='operators', nargs='+', default=None, choices=list(OPERATORS),
+                        help='[OPTIONAL] Set the local search operators combined in each iteration.')
+    parser.add_argument('--history', dest='history', type=str, default=None, choices=solution_history.LEVELS,
+                        help='[OPTIONAL] Set which moves are recorded (by default "accepted" if the graph is '
+                             'visualized and "none" otherwise).')
+    parser.add_argument('--history_every', dest='history_every', type=int, default=100,
+                        help='[OPTIONAL] Record every k-th evaluated move for the history "sampled".')
+    parser.add_argument('--stats', dest='stats', default=False, action="store_true",
+                        help='[OPTIONAL] Print the number of evaluated and accepted moves and the sweep times.')
+    parser.add_argument('-p', '--profile', dest='profile', type=str, nargs='?', default=None, const=PROFILERS[0],
+                        choices=PROFILERS,
+                        help='[OPTIONAL] Profile the solver with the given profiler (cprofile if no profiler is '
+                             'given).')
+    parser.add_argument('--profile_output', dest='profile_output', type=str, default=None,
+                        help='[OPTIONAL] Write the profile to the given file instead of printing it.')
     parser.add_argument('-m', '--vis_map', dest='vis_map', default=False, action="store_true",
                         help='[OPTIONAL] Enable visualization of the cities on a map using your webbrowser.')
     parser.add_argument('-g', '--vis_graph', dest='vis_graph', default=False, action="store_true",
                         help='[OPTIONAL] Enable visualization of the algorithm steps as a graph using your webbrowser.')
+    parser.add_argument('--max_frames', dest='max_frames', type=int, default=200,
+                        help='[OPTIONAL] Set the maximum number of frames of the graph animation, the recorded steps '
+                             'are sampled evenly (0 shows all steps).')
+    parser.add_argument('--frame_steps', dest='frame_steps', type=str, default='accepted', choices=['accepted', 'all'],
+                        help='[OPTIONAL] Set the recorded steps shown in the graph animation: the accepted moves only, '
+                             'or the sampled candidate moves too (with --history sampled).')
+    parser.add_argument('--wait_export', dest='wait_export', default=False, action="store_true",
+                        help='[OPTIONAL] Wait until the visualizations of -m and -g are exported. By default, they are '
+                             'exported by background processes and the program ends right after printing the result.')
     return parser.parse_args()
 
 
-def load_args():
+def load_args() -> argparse.Namespace:
     """
-    Helper function to setup and interpret command line arguments for further algorithms.
+    Helper function to setup and interpret command line arguments for further algorithms. The unset arguments are
+    filled with their defaults (load, iterations, score, history), cache is replaced by the distance_cache and stats by
+    the solver_stats, which are None if not set.
     :return:
-    path: str
-    iter: int
-    score: float
+    args: argparse.Namespace
+        Arguments of get_args
     """
     args = get_args()
+    args.cache = distance_cache(args.cache, args.cache_size * 2 ** 20) if args.cache else None
+    args.stats = solver_stats() if args.stats else None
 
-    path = args.load
-    iterate = args.iterations
-    score = args.score
-    vis_map = args.vis_map
-    vis_graph = args.vis_graph
+    if not args.load:
+        args.load = "msg_standorte_deutschland.csv"
+        logging.warning("Path set to {p} by default".format(p=args.load))
 
-    if not path:
-        path = "msg_standorte_deutschland.csv"
-        logging.warning("Path set to {p} by default".format(p=path))
+    if not args.iterations:
+        args.iterations = 10
+        logging.warning("Iterations set to {i} by default".format(i=args.iterations))
 
-    if not iterate:
-        iterate = 10
-        logging.warning("Iterations set to {i} by default".format(i=iterate))
+    if not args.score:
+        args.score = 0.00001
 
-    if not score:
-        score = 0.00001
+    if not args.history:
+        args.history = "accepted" if args.vis_graph else "none"
 
-    return path, iterate, score, vis_map, vis_graph
+    return args
 
 
 if __name__ == "__main__":
@@ -64,17 +145,58 @@ if __name__ == "__main__":
     logging.basicConfig(level=logging.WARNING)
 
     # Setup Argumentparser:
-    path, iter, score, vis_map, vis_graph = load_args()
+    args = load_args()
+    stats = args.stats
+
+    if args.batch is not None:
+        from utils.batch import read_instances, solve_instances
+
+        # Solve all instances in batches and print each result as soon as its batch is solved:
+        for name, frame, sequence, dist in solve_instances(read_instances(args.load, args.batch),
+                                                           batch_size=args.batch_size, iterations=args.iterations):
+            print("{n}: {d} km: {s}".format(n=name, d=dist,
+                                            s=" -> ".join(str(c) for c in frame["msg Standort"].to_numpy()[sequence])))
+        sys.exit()
+
+    if args.serve is not None:
+        from utils.service import solver_service
+
+        # Answer solve requests with the site sets kept in the worker processes:
+        service = solver_service(args.load, jobs=args.jobs, cache=args.cache,
+                                 defaults=dict(iterations=args.iterations, score=args.score, neighbors=args.neighbors,
+                                               operators=args.operators, init=args.init, restart=args.restart,
+                                               solver=args.solver, time_limit=args.time_limit, depot=args.depot))
+        service.serve(args.serve)
+        sys.exit()
 
     # Load file:
-    csvloader = loadcsv(path)
-    data_frame, dist_frame = csvloader.get_data()
-
-    # Solve problem:
-    tspsolver = solvetsp(dist_frame)
-    tspsolver.set_init(rand=True)  # Possibility to set specific initial tour
-    tspsolver.solve_opt2(scorethresh=score, iterations=iter)  # This function executes the algorithm
+    csvloader = loadcsv(args.load, cache=args.cache, read_chunk_size=args.stream, sparse_k=args.sparse, engine="numpy",
+                        kernel=args.kernel)
+    sites, dist_frame = csvloader.get_arrays()
+
+    # Solve problem (with --sites on the distances of the subset, numbered like ids):
+    ids, index, depot = None, None, args.depot
+    if args.sites:
+        ids, dist_frame, index = csvloader.get_subset(args.sites + [depot])
+        depot = ids.tolist().index(depot)
+    elif args.neighbors or args.init != "random" or args.solver == "lk":
+        index = csvloader.get_index()
+    tspsolver = solvelk(dist_frame, index=index, depot=depot) if args.solver == "lk" else \
+        solvetsp(dist_frame, index=index, depot=depot)
+    tspsolver.set_init(rand=True, method=args.init)  # Possibility to set specific initial tour
+    with profiling(args.profile, args.profile_output):
+        if args.solver == "lk":
+            tspsolver.solve_lk(scorethresh=args.score, iterations=args.iterations, jobs=args.jobs,
+                               neighbors=args.neighbors, history=args.history, history_every=args.history_every,
+                               stats=stats, time_limit=args.time_limit, restart=args.restart)
+        else:
+            tspsolver.solve_opt2(scorethresh=args.score, iterations=args.iterations, jobs=args.jobs,
+                                 neighbors=args.neighbors, operators=args.operators, history=args.history,
+                                 history_every=args.history_every, stats=stats, time_limit=args.time_limit,
+                                 restart=args.restart, kernel=args.kernel)  # This function executes the algorithm
     sequence, dist = tspsolver.get_result()
+    if ids is not None:
+        sequence = ids[sequence].tolist()
 
     # Print output:-----------------------------------------------
     output = "\n### Result ######################################################\n" \
@@ -82,17 +204,35 @@ if __name__ == "__main__":
              "-- Total Distance in kilometer: {d}\n\n" \
              "-- Best found order of cities: \n".format(d=dist)
     for s in sequence:
-        output = output + "       {c}\n".format(c=data_frame["msg Standort"][s])
+        output = output + "       {c}\n".format(c=sites.get_name(s))
+    if stats is not None:
+        summary = stats.get_summary()
+        output = output + "-- Evaluated moves: {e}\n" \
+                          "-- Accepted moves: {a}\n" \
+                          "-- Sweeps: {s} in {t:.3f} seconds\n".format(e=summary["moves_evaluated"],
+                                                                     a=summary["moves_accepted"],
+                                                                     s=summary["sweeps"], t=summary["sweep_time"])
     output = output + "#################################################################\n"
-    print(output)
-
-    if vis_map:
-        logging.debug("Visualizing the cities on a map as html in the default webbrowser")
-        map = visualize_map(data_frame)
-        map.visualize_sequence_on_map(sequence)
-
-    if vis_graph:
-        logging.debug("Visualizing the graph showing all sequences of the best iteration as html in the default webbrowser")
-        graph = visualize_graph(tspsolver, data_frame)
-        graph.visualize_sequences_in_graph()
-
+    print(output, flush=True)
+
+    if args.vis_map or args.vis_graph:
+        from utils.export import export_pool, solver_result
+
+        # Render the html-files in background processes:
+        exports = export_pool(detach=not args.wait_export)
+        data_frame = csvloader.get_data()[0]
+        if args.vis_map:
+            logging.debug("Visualizing the cities on a map as html in the default webbrowser")
+            exports.export_map(data_frame, sequence)
+        if args.vis_graph:
+            logging.debug("Visualizing the graph showing all sequences of the best iteration as html in the default "
+                          "webbrowser")
+            # The sequences of the solver are numbered like the subset:
+            exports.export_graph(solver_result.from_solver(tspsolver),
+                                 data_frame if ids is None else data_frame.iloc[ids].reset_index(drop=True),
+                                 max_frames=args.max_frames, frame_steps=args.frame_steps)
+        try:
+            exports.wait()
+        except RuntimeError as error:
+            logging.error(error)
+            sys.exit(1)
@@ -0,0 +1,184 @@
+from typing import Tuple, Optional, Iterator, Iterable
+import logging
+import os
+import numpy as np
+import pandas as pd
+
+from .spatial import haversine
+from .sites import LAT_COLUMN, LON_COLUMN
+
+
+def read_instances(path: str,
+                   group_column: Optional[str] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+    """
+    Reads many independent instances, either from a directory of csv-files (one instance per file, named after the
+    file) or from a single csv-file whose rows are grouped by group_column (one instance per group, named after its
+    value). The first location of each instance is its depot, where the tour starts and ends.
+    :param path: str
+        Directory of csv-files or csv-file
+    :param group_column: str
+        Column of the csv-file the instances are grouped by, only used for a single csv-file
+    :return:
+    Iterator over the name and dataframe of each instance
+    """
+    if os.path.isdir(path):
+        for file in sorted(os.listdir(path)):
+            if file.lower().endswith(".csv"):
+                yield os.path.splitext(file)[0], pd.read_csv(os.path.join(path, file))
+        return
+    if not group_column:
+        raise ValueError("A group column is needed to read several instances from the csv-file {p}".format(p=path))
+    data = pd.read_csv(path)
+    for name, frame in data.groupby(group_column, sort=False):
+        yield str(name), frame.reset_index(drop=True)
+
+
+def get_distances(frame: pd.DataFrame) -> np.ndarray:
+    """
+    Calculates the distance matrix of the locations of one instance in km.
+    :param frame: dataframe
+        Locations with the columns "Breitengrad" and "Längengrad"
+    :return:
+    dist: array [float] of shape (n, n)
+    """
+    lat = np.radians(frame[LAT_COLUMN].to_numpy(dtype=np.float64))
+    lon = np.radians(frame[LON_COLUMN].to_numpy(dtype=np.float64))
+    dist = haversine(lat[:, None], lon[:, None], lat[None, :], lon[None, :])
+    np.fill_diagonal(dist, 0)
+    return dist
+
+
+def pack_distances(matrices: list) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Packs the distance matrices of several instances into one array, padded with zeros to the largest instance.
+    :param matrices: list [array]
+        Distance matrices of shape (n_b, n_b)
+    :return:
+    dist: array [float] of shape (b, n, n)
+    sizes: array [int]
+        Number of locations of each instance
+    """
+    sizes = np.array([len(matrix) for matrix in matrices], dtype=np.intp)
+    dist = np.zeros((len(matrices), max(sizes.max(initial=0), 1), max(sizes.max(initial=0), 1)), dtype=np.float64)
+    for b, matrix in enumerate(matrices):
+        dist[b, :sizes[b], :sizes[b]] = matrix
+    return dist, sizes
+
+
+def solve_packed(dist: np.ndarray,
+                 sizes: np.ndarray,
+                 iterations: int = 1,
+                 rng: Optional[np.random.Generator] = None,
+                 max_sweeps: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Solves all packed instances at once with 2-opt. The tours are held as one array of shape (b, n + 1), each starting
+    and ending at location 0 and padded with location 0, whose padding edges have length 0. In each sweep, the deltas of
+    all moves (reversal of the positions i to j) of all instances which still improve are evaluated with one gather
+    from the 3-D distance array, and each instance applies its best improving move. Moves reaching into the padding are
+    masked. For several iterations, each instance is solved from several random initial routes in the same batch.
+    :param dist: array [float] of shape (b, n, n)
+        Packed distance matrices, see pack_distances
+    :param sizes: array [int]
+        Number of locations of each instance
+    :param iterations: int
+        Number of random initial routes per instance, the best result is returned
+    :param rng: numpy random generator for the initial routes
+    :param max_sweeps: int
+        Maximum number of sweeps, unlimited if not set
+    :return:
+    tours: array [int] of shape (b, n + 1)
+        Best sequence of each instance, only the first sizes[b] + 1 entries are valid
+    dists: array [float]
+        Total distance of the best sequence of each instance
+    """
+    rng = rng if rng is not None else np.random.default_rng()
+    count, num = len(sizes), dist.shape[1]
+    instance = np.repeat(np.arange(count), iterations)  # Instance of each tour
+    size = sizes[instance]
+
+    # Random initial routes: location 0 first, the other locations shuffled, then location 0 again and the padding:
+    keys = rng.random((len(instance), num))
+    positions = np.arange(num)
+    keys[:, 0] = -1
+    keys[positions[None, :] >= size[:, None]] = np.inf
+    tours = np.zeros((len(instance), num + 1), dtype=np.intp)
+    tours[:, :num] = np.argsort(keys, axis=1)
+    tours[:, :num][positions[None, :] >= size[:, None]] = 0
+
+    # Valid moves (i, j) with 1 <= i < j <= size - 1, as offsets i - 1 and j - 1:
+    i_offset, j_offset = np.meshgrid(np.arange(num - 1), np.arange(num - 1), indexing="ij")
+    upper = j_offset > i_offset
+    active = np.flatnonzero(size > 3)
+    sweeps = 0
+    while len(active) and (max_sweeps is None or sweeps < max_sweeps):
+        t = tours[active]
+        b = instance[active][:, None]
+        edges = dist[b, t[:, :-1], t[:, 1:]]  # Edge from position p to p + 1
+        prev_i, cur_i, cur_j, next_j = t[:, :num - 1], t[:, 1:num], t[:, 1:num], t[:, 2:num + 1]
+        bb = b[:, :, None]
+        delta = (dist[bb, prev_i[:, :, None], cur_j[:, None, :]] + dist[bb, cur_i[:, :, None], next_j[:, None, :]]) - \
+            (edges[:, :num - 1, None] + edges[:, None, 1:num])
+        valid = upper[None] & (j_offset[None] <= (size[active] - 2)[:, None, None])
+        delta = np.where(valid, delta, np.inf).reshape(len(active), -1)
+        best = np.argmin(delta, axis=1)
+        improving = delta[np.arange(len(active)), best] < -1e-10
+        if not improving.any():
+            break
+
+        # Reverse the positions i to j of each improving tour in one gather:
+        active, best = active[improving], best[improving]
+        i = best // (num - 1) + 1
+        j = best % (num - 1) + 1
+        inside = (positions[None, :] >= i[:, None]) & (positions[None, :] <= j[:, None])
+        source = np.where(inside, i[:, None] + j[:, None] - positions[None, :], positions[None, :])
+        tours[active, :num] = np.take_along_axis(tours[active, :num], source, axis=1)
+        sweeps += 1
+    logging.debug("Solved {c} tours of {b} instances in {s} sweeps".format(c=len(instance), b=count, s=sweeps))
+
+    # Keep the best tour of each instance:
+    total = dist[instance[:, None], tours[:, :-1], tours[:, 1:]].sum(axis=1)
+    best = np.argmin(total.reshape(count, iterations), axis=1) + np.arange(count) * iterations
+    return tours[best], total[best]
+
+
+def solve_instances(instances: Iterable[Tuple[str, pd.DataFrame]],
+                    batch_size: int = 256,
+                    iterations: int = 1,
+                    seed: Optional[int] = None) -> Iterator[Tuple[str, pd.DataFrame, list, float]]:
+    """
+    Solves many independent instances in batches of batch_size instances with solve_packed. The results of each
+    batch are yielded as soon as it is solved, so only one batch of instances is held at a time.
+    :param instances: iterable of (str, dataframe)
+        Name and locations of each instance, e.g. from read_instances
+    :param batch_size: int
+        Number of instances solved at once
+    :param iterations: int
+        Number of random initial routes per instance
+    :param seed: int
+        Seed of the initial routes
+    :return:
+    Iterator over the name, dataframe, best sequence (in numbers of the rows of the dataframe, starting and ending
+    at 0) and total distance of each instance, in the order of the instances
+    """
+    rng = np.random.default_rng(seed)
+    batch = []
+    for instance in instances:
+        batch.append(instance)
+        if len(batch) == batch_size:
+            yield from _solve_batch(batch, iterations, rng)
+            batch = []
+    if batch:
+        yield from _solve_batch(batch, iterations, rng)
+
+
+def _solve_batch(batch: list,
+                 iterations: int,
+                 rng: np.random.Generator) -> Iterator[Tuple[str, pd.DataFrame, list, float]]:
+    """
+    Internal function solving one batch of instances for solve_instances.
+    """
+    dist, sizes = pack_distances([get_distances(frame) for name, frame in batch])
+    tours, dists = solve_packed(dist, sizes, iterations, rng)
+    for (name, frame), tour, size, total in zip(batch, tours, sizes, dists):
+        sequence = tour[:size + 1].tolist() if size else []
+        yield name, frame, sequence, float(total)
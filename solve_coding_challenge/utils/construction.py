@@ -0,0 +1,323 @@
+from typing import Optional
+import numpy as np
+
+CONSTRUCTIONS = ("random", "nearest", "greedy", "hilbert", "insertion")
+
+
+def _get_row(d: np.ndarray,
+             i: int) -> np.ndarray:
+    """
+    Internal function returning the distances from location i to all locations, for a dense matrix as well as for a
+    utils.knn_graph.knn_graph.
+    """
+    if isinstance(d, np.ndarray):
+        return np.asarray(d[i], dtype=np.float64)
+    return d[i, np.arange(len(d))]
+
+
+def _rotate_to(order: np.ndarray,
+               start: int) -> np.ndarray:
+    """
+    Internal function rotating a closed tour given as order of all locations, so it begins at the location start.
+    """
+    i = int(np.flatnonzero(order == start)[0])
+    return np.concatenate((order[i:], order[:i]))
+
+
+def nearest_neighbor(d: np.ndarray,
+                     start: int = 0,
+                     neighbors: Optional[np.ndarray] = None) -> np.ndarray:
+    """
+    Builds a tour by always moving on to the closest location which is not yet visited. If candidate lists of the
+    nearest neighbours are given, the first unvisited location in the list of the current location is the closest one,
+    and only if all of them are visited, all locations are scanned.
+    :param d: array or knn_graph
+        Distance matrix
+    :param start: int
+        First location of the tour
+    :param neighbors: array [int] of shape (n, k)
+        Nearest neighbours of each location sorted by distance
+    :return:
+    order: array [int]
+        All locations in tour order, beginning with start
+    """
+    num = len(d)
+    visited = np.zeros(num, dtype=bool)
+    order = np.empty(num, dtype=np.intp)
+    current = start
+    for step in range(num):
+        order[step] = current
+        visited[current] = True
+        if step == num - 1:
+            break
+        if neighbors is not None:
+            candidates = neighbors[current][~visited[neighbors[current]]]
+            if len(candidates):
+                current = candidates[0]
+                continue
+        unvisited = np.flatnonzero(~visited)
+        current = unvisited[np.argmin(d[current, unvisited])]
+    return order
+
+
+def greedy_edge(d: np.ndarray,
+                neighbors: np.ndarray,
+                start: int = 0,
+                noise: float = 0.0,
+                rng: Optional[np.random.Generator] = None) -> np.ndarray:
+    """
+    Builds a tour with the greedy edge heuristic: the candidate edges to the nearest neighbours are added from the
+    shortest to the longest, skipping edges which would give a location a third edge or close a cycle. The remaining
+    path fragments are joined by repeatedly moving from the end of the current fragment to the closest end of another.
+    :param d: array or knn_graph
+        Distance matrix
+    :param neighbors: array [int] of shape (n, k)
+        Nearest neighbours of each location, which define the candidate edges
+    :param start: int
+        Location the resulting order begins with
+    :param noise: float
+        If set, the edge lengths are scaled by random factors between 1 and 1 + noise before sorting, which gives a
+        different tour on each call
+    :param rng: numpy random generator for the noise
+    :return:
+    order: array [int]
+        All locations in tour order, beginning with start
+    """
+    num = len(d)
+    if num < 3:
+        return np.arange(num)
+
+    # Candidate edges (i, j) with i < j, each once:
+    i = np.repeat(np.arange(num), neighbors.shape[1])
+    j = neighbors.ravel()
+    i, j = np.minimum(i, j), np.maximum(i, j)
+    keys = np.unique(i * num + j)
+    i, j = keys // num, keys % num
+    lengths = d[i, j]
+    if noise:
+        rng = rng if rng is not None else np.random.default_rng()
+        lengths = lengths * (1 + noise * rng.random(len(lengths)))
+
+    # Add the edges from the shortest on, while all degrees stay below 3 and no cycle is closed:
+    adjacent = np.full((num, 2), -1, dtype=np.intp)
+    degree = np.zeros(num, dtype=np.intp)
+    parent = list(range(num))
+
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+
+    added = 0
+    for e in np.argsort(lengths, kind="stable").tolist():
+        a, b = int(i[e]), int(j[e])
+        if degree[a] == 2 or degree[b] == 2:
+            continue
+        root_a, root_b = find(a), find(b)
+        if root_a == root_b:
+            continue
+        parent[root_a] = root_b
+        adjacent[a, degree[a]] = b
+        adjacent[b, degree[b]] = a
+        degree[a] += 1
+        degree[b] += 1
+        added += 1
+        if added == num - 1:
+            break
+
+    # Collect the fragments as paths from one end to the other:
+    fragments = []
+    seen = np.zeros(num, dtype=bool)
+    for end in np.flatnonzero(degree < 2).tolist():
+        if seen[end]:
+            continue
+        path = [end]
+        seen[end] = True
+        previous, current = -1, end
+        while True:
+            following = [x for x in adjacent[current, :degree[current]].tolist() if x != previous]
+            if not following:
+                break
+            previous, current = current, following[0]
+            path.append(current)
+            seen[current] = True
+        fragments.append(np.array(path, dtype=np.intp))
+
+    # Join the fragments, starting with the fragment of the start location:
+    first = next(f for f, path in enumerate(fragments) if start in path)
+    heads = np.array([path[0] for path in fragments])
+    tails = np.array([path[-1] for path in fragments])
+    used = np.zeros(len(fragments), dtype=bool)
+    used[first] = True
+    order = [fragments[first]]
+    current = tails[first]
+    for _ in range(len(fragments) - 1):
+        free = np.flatnonzero(~used)
+        to_head = d[current, heads[free]]
+        to_tail = d[current, tails[free]]
+        best_head, best_tail = np.argmin(to_head), np.argmin(to_tail)
+        if to_head[best_head] <= to_tail[best_tail]:
+            f = free[best_head]
+            order.append(fragments[f])
+            current = tails[f]
+        else:
+            f = free[best_tail]
+            order.append(fragments[f][::-1])
+            current = heads[f]
+        used[f] = True
+    return _rotate_to(np.concatenate(order), start)
+
+
+def hilbert_keys(x: np.ndarray,
+                 y: np.ndarray,
+                 bits: int = 16) -> np.ndarray:
+    """
+    Calculates the position of the given grid points along a Hilbert curve through a grid of 2^bits x 2^bits points.
+    :param x: array [int]
+    :param y: array [int]
+    :param bits: int
+    :return:
+    keys: array [int]
+    """
+    size = 1 << bits
+    x = np.array(x, dtype=np.int64)
+    y = np.array(y, dtype=np.int64)
+    keys = np.zeros(len(x), dtype=np.int64)
+    s = size >> 1
+    while s > 0:
+        rx = (x & s) > 0
+        ry = (y & s) > 0
+        keys += s * s * ((3 * rx) ^ ry)
+        # Rotate the quadrant, so the curve continues in the right orientation:
+        flip = ~ry & rx
+        x = np.where(flip, size - 1 - x, x)
+        y = np.where(flip, size - 1 - y, y)
+        x, y = np.where(~ry, y, x), np.where(~ry, x, y)
+        s >>= 1
+    return keys
+
+
+def space_filling_curve(lat: np.ndarray,
+                        lon: np.ndarray,
+                        start: int = 0,
+                        angle: float = 0.0,
+                        bits: int = 16) -> np.ndarray:
+    """
+    Builds a tour by visiting the locations in the order of a Hilbert curve through the map. Neighbouring locations on
+    the curve are close to each other, so the tour is about 25% longer than optimal, and it is built in O(n log n).
+    :param lat: array [float]
+        Latitudes in radians
+    :param lon: array [float]
+        Longitudes in radians
+    :param start: int
+        Location the resulting order begins with
+    :param angle: float
+        Rotation of the map against the curve in radians, a different angle gives a different tour
+    :param bits: int
+        Resolution of the curve
+    :return:
+    order: array [int]
+        All locations in tour order, beginning with start
+    """
+    # Equirectangular projection around the mean latitude, rotated by angle:
+    x = lon * np.cos(np.mean(lat)) if len(lat) else lon
+    y = lat
+    x, y = x * np.cos(angle) - y * np.sin(angle), x * np.sin(angle) + y * np.cos(angle)
+    x = x - x.min() if len(x) else x
+    y = y - y.min() if len(y) else y
+    scale = max(float(x.max()) if len(x) else 0.0, float(y.max()) if len(y) else 0.0) or 1.0
+    top = (1 << bits) - 1
+    keys = hilbert_keys(np.round(x / scale * top), np.round(y / scale * top), bits)
+    return _rotate_to(np.argsort(keys, kind="stable"), start)
+
+
+def cheapest_insertion(d: np.ndarray,
+                       start: int = 0) -> np.ndarray:
+    """
+    Builds a tour with the cheapest insertion heuristic: beginning with the start location, the location which
+    increases the tour length the least is inserted into its best edge until all locations are inserted. The cheapest
+    insertion of every location is kept up to date with vectorized updates for the two new edges, so the heuristic
+    takes O(n^2) time and O(n) memory besides the distances (intended for up to a few ten thousand locations).
+    :param d: array or knn_graph
+        Distance matrix
+    :param start: int
+        First location of the tour
+    :return:
+    order: array [int]
+        All locations in tour order, beginning with start
+    """
+    num = len(d)
+    succ = np.full(num, -1, dtype=np.intp)  # Successor of each inserted location
+    edge_length = np.zeros(num, dtype=np.float64)  # Length of the edge from each inserted location to its successor
+    inserted = np.zeros(num, dtype=bool)
+    tour_nodes = np.empty(num, dtype=np.intp)  # Inserted locations in order of insertion
+    succ[start] = start
+    inserted[start] = True
+    tour_nodes[0] = start
+    count = 1
+
+    cost = 2 * _get_row(d, start)  # Cheapest increase of the tour length by inserting each location
+    best_from = np.full(num, start, dtype=np.intp)  # Start of the edge each location is inserted into at that cost
+    cost[start] = np.inf
+
+    for _ in range(num - 1):
+        c = int(np.argmin(cost))
+        i = int(best_from[c])
+        j = int(succ[i])
+        succ[i], succ[c] = c, j
+        row_i, row_c, row_j = _get_row(d, i), _get_row(d, c), _get_row(d, j)
+        edge_length[i], edge_length[c] = row_i[c], row_c[j]
+        inserted[c] = True
+        tour_nodes[count] = c
+        count += 1
+        cost[c] = np.inf
+
+        # Locations whose cheapest edge (i, j) was split search all edges again:
+        for u in np.flatnonzero((best_from == i) & ~inserted).tolist():
+            starts = tour_nodes[:count]
+            costs = d[u, starts] + d[u, succ[starts]] - edge_length[starts]
+            best = int(np.argmin(costs))
+            cost[u], best_from[u] = costs[best], starts[best]
+
+        # All other locations compare their cheapest insertion with the two new edges:
+        for a, row_a, row_b, length in ((i, row_i, row_c, edge_length[i]), (c, row_c, row_j, edge_length[c])):
+            new_cost = row_a + row_b - length
+            better = (new_cost < cost) & ~inserted
+            cost[better] = new_cost[better]
+            best_from[better] = a
+
+    order = np.empty(num, dtype=np.intp)
+    current = start
+    for step in range(num):
+        order[step] = current
+        current = succ[current]
+    return order
+
+
+def insert_cheapest(d: np.ndarray,
+                    order: np.ndarray,
+                    locations: np.ndarray) -> np.ndarray:
+    """
+    Inserts the given locations one after another into an existing closed tour, each at the edge which increases the
+    tour length the least. Every insertion scores all edges of the tour at once, so inserting a few locations into a
+    large tour takes O(n) per location.
+    :param d: array or knn_graph
+        Distance matrix
+    :param order: array [int]
+        Locations of the tour in tour order, without closing repetition
+    :param locations: array [int]
+        Locations to be inserted, which are not part of the tour yet
+    :return:
+    order: array [int]
+        All locations in tour order, beginning with the first location of the given order
+    """
+    order = np.asarray(order, dtype=np.intp)
+    for c in np.asarray(locations, dtype=np.intp).tolist():
+        if not len(order):
+            order = np.array([c], dtype=np.intp)
+            continue
+        following = np.roll(order, -1)
+        costs = d[order, c] + d[c, following] - d[order, following]
+        order = np.insert(order, int(np.argmin(costs)) + 1, c)
+    return order
@@ -0,0 +1,141 @@
+from typing import Optional, Callable
+import hashlib
+import logging
+import os
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "solve_coding_challenge")
+
+
+class distance_cache:
+    def __init__(self,
+                 directory: str = DEFAULT_CACHE_DIR,
+                 max_bytes: int = 2 ** 30):
+        """
+        This class stores computed distance matrices as .npy-files in a directory. The matrices are loaded as read-only
+        memory maps, so repeated runs start without recomputation and concurrent processes share the same pages. If
+        the files exceed max_bytes in total, the least recently used ones are removed.
+
+        :param directory: str
+            Directory of the cache files
+        :param max_bytes: int
+            Maximum total size of all cache files in bytes
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def get_key(lat: np.ndarray,
+                lon: np.ndarray,
+                metric: str,
+                dtype: np.dtype) -> str:
+        """
+        Creates the cache key from the coordinates, the distance metric and the data type of the matrix.
+        :param lat: array [float]
+        :param lon: array [float]
+        :param metric: str
+            Name and parameters of the distance metric
+        :param dtype: dtype
+        :return:
+        key: str
+        """
+        sha = hashlib.sha256()
+        sha.update(np.ascontiguousarray(lat, dtype=np.float64).tobytes())
+        sha.update(np.ascontiguousarray(lon, dtype=np.float64).tobytes())
+        sha.update(metric.encode())
+        sha.update(np.dtype(dtype).str.encode())
+        return sha.hexdigest()
+
+    def _get_path(self,
+                  key: str) -> str:
+        return os.path.join(self.directory, key + ".npy")
+
+    def load(self,
+             key: str) -> Optional[np.ndarray]:
+        """
+        Loads the matrix with the given key as read-only memory map.
+        :param key: str
+        :return:
+        matrix: array, None if the key is not cached
+        """
+        path = self._get_path(key)
+        try:
+            matrix = np.load(path, mmap_mode="r")
+        except (FileNotFoundError, ValueError, OSError):
+            return None
+        try:
+            os.utime(path)  # Mark as recently used for the eviction
+        except OSError:
+            pass  # Read-only or shared cache directory, the file is evicted by its age only
+        logging.debug("Loaded distance matrix from cache {p}".format(p=path))
+        return matrix
+
+    def compute(self,
+                key: str,
+                shape: tuple,
+                dtype: np.dtype,
+                fill: Callable[[np.ndarray], None]) -> np.ndarray:
+        """
+        Computes a matrix directly into a new cache file and returns it as read-only memory map. The file is written
+        under a temporary name and renamed when complete, so concurrent processes never load a partial matrix.
+        :param key: str
+        :param shape: tuple
+            Shape of the matrix
+        :param dtype: dtype
+            Data type of the matrix
+        :param fill: function
+            Function filling the given (writable, memory mapped) matrix
+        :return:
+        matrix: array
+        """
+        path = self._get_path(key)
+        tmp_path = "{p}.{pid}.tmp".format(p=path, pid=os.getpid())
+        try:
+            matrix = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=shape)
+            fill(matrix)
+            matrix.flush()
+            del matrix
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        logging.debug("Stored distance matrix in cache {p}".format(p=path))
+        self._evict(keep=path)
+        return np.load(path, mmap_mode="r")
+
+    def _evict(self,
+               keep: Optional[str] = None):
+        """
+        Internal function removing the least recently used cache files until their total size is below max_bytes.
+        :param keep: str
+            Path of a file which is never removed
+        :return:
+        """
+        entries = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(".npy"):
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path == keep:
+                continue
+            try:
+                os.remove(path)
+                logging.debug("Removed distance matrix {p} from cache".format(p=path))
+            except FileNotFoundError:
+                pass
+            except OSError as error:
+                # E.g. opened by another process on Windows, try the next file:
+                logging.debug("Could not remove distance matrix {p} from cache: {e}".format(p=path, e=error))
+                continue
+            total -= size
@@ -0,0 +1,189 @@
+from typing import Optional, List
+from concurrent.futures import ProcessPoolExecutor
+import logging
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+
+from .history import solution_history
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))  # Directory containing utils
+
+
+class solver_result:
+    def __init__(self,
+                 sequence: list,
+                 dist: float,
+                 history: Optional[solution_history] = None):
+        """
+        This class holds the result of a solver which is needed for the visualizations (best sequence, total distance
+        and history of the best iteration), so it can be sent to another process without the distance matrix.
+
+        :param sequence: list [int]
+        :param dist: float
+        :param history: solution_history
+        """
+        self.sequence = sequence
+        self.dist = dist
+        self.history = history
+
+    @classmethod
+    def from_solver(cls,
+                    tspsolver) -> "solver_result":
+        """
+        Takes the result of a solver from utils.tsp.
+        :param tspsolver: solvetsp
+        :return:
+        result: solver_result
+        """
+        sequence, dist = tspsolver.get_result()
+        return cls(sequence, dist, tspsolver.get_best_history())
+
+    def get_result(self):
+        return self.sequence, self.dist
+
+    def get_best_history(self) -> Optional[solution_history]:
+        return self.history
+
+
+def _export_map(dataframe,
+                sequence: list,
+                fname: str,
+                open_browser: bool) -> str:
+    """
+    Internal function rendering the map in a worker process, see utils.visualization.visualize_map.
+    """
+    from .visualization import visualize_map
+    return visualize_map(dataframe).visualize_sequence_on_map(sequence, fname, open_browser)
+
+
+def _export_graph(result: solver_result,
+                  dataframe,
+                  fname: str,
+                  max_frames: Optional[int],
+                  frame_steps: str,
+                  open_browser: bool) -> str:
+    """
+    Internal function rendering the graph in a worker process, see utils.visualization.visualize_graph.
+    """
+    from .visualization import visualize_graph
+    graph = visualize_graph(result, dataframe, max_frames=max_frames, frame_steps=frame_steps)
+    return graph.visualize_sequences_in_graph(fname, open_browser)
+
+
+class export_pool:
+    def __init__(self,
+                 jobs: int = 2,
+                 detach: bool = False):
+        """
+        This class renders the html-files of the visualizations in the background, so the result of the solver is
+        available before the figures are built. Each export runs in its own process (plotly and ipyleaflet are only
+        imported there) and serializes its figure once.
+
+        :param jobs: int
+            Number of worker processes rendering at the same time
+        :param detach: bool
+            Start every export as a detached process, which keeps running after this program has finished, instead of
+            a worker of a pool which is joined by wait(). The output of a detached export is written to a log-file
+            next to its html-file.
+        """
+        self.jobs = jobs
+        self.detach = detach
+        self.pool = None
+        self.futures = []
+        self.paths = []  # Paths of the html-files
+
+    def export_map(self,
+                   dataframe,
+                   sequence: list,
+                   fname: str = "utils/tmp/map.html",
+                   open_browser: bool = True):
+        """
+        Starts the export of the map, see utils.visualization.visualize_map.
+        :param dataframe: dataframe
+        :param sequence: list [int]
+        :param fname: str
+            Path of the html-file
+        :param open_browser: bool
+            Open the html-file in the default webbrowser when it is written
+        :return:
+        """
+        self._submit(_export_map, dataframe, sequence, os.path.realpath(fname), open_browser)
+
+    def export_graph(self,
+                     result: solver_result,
+                     dataframe,
+                     fname: str = "utils/tmp/graph.html",
+                     max_frames: Optional[int] = 200,
+                     frame_steps: str = "accepted",
+                     open_browser: bool = True):
+        """
+        Starts the export of the graph, see utils.visualization.visualize_graph.
+        :param result: solver_result
+        :param dataframe: dataframe
+        :param fname: str
+            Path of the html-file
+        :param max_frames: int
+            Maximum number of frames of the animation
+        :param frame_steps: str
+            Recorded steps shown as frames
+        :param open_browser: bool
+            Open the html-file in the default webbrowser when it is written
+        :return:
+        """
+        self._submit(_export_graph, result, dataframe, os.path.realpath(fname), max_frames, frame_steps, open_browser)
+
+    def _submit(self,
+                function,
+                *args):
+        """
+        Internal function starting one export. The third argument of every export function is the path of its file.
+        """
+        path = args[2]
+        self.paths.append(path)
+        if not self.detach:
+            if self.pool is None:
+                self.pool = ProcessPoolExecutor(max_workers=max(self.jobs, 1))
+            self.futures.append((path, self.pool.submit(function, *args)))
+            return
+
+        # Hand the arguments to a new process over a temporary file, which the process removes:
+        with tempfile.NamedTemporaryFile(suffix=".pkl", delete=False) as file:
+            pickle.dump((function, args), file)
+        with open(os.path.splitext(path)[0] + ".log", "wb") as log:
+            subprocess.Popen([sys.executable, "-m", "utils.export", file.name], cwd=ROOT_DIR, stdin=subprocess.DEVNULL,
+                             stdout=log, stderr=log, start_new_session=True)
+        logging.debug("Exporting {p} in the background".format(p=path))
+
+    def wait(self) -> List[str]:
+        """
+        Waits until all exports of the pool are written (detached exports are not waited for). If an export fails, the
+        error is logged and a RuntimeError is raised after all other exports have finished.
+        :return:
+        paths: list [str]
+            Paths of the html-files
+        """
+        failed = []
+        for path, future in self.futures:
+            try:
+                future.result()
+            except Exception as error:
+                logging.error("Export of {p} failed: {e!r}".format(p=path, e=error))
+                failed.append(path)
+        self.futures = []
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        if failed:
+            raise RuntimeError("Export failed for {f}".format(f=failed))
+        return self.paths
+
+
+if __name__ == "__main__":
+    # Entry point of a detached export:
+    with open(sys.argv[1], "rb") as payload:
+        export, export_args = pickle.load(payload)
+    os.remove(sys.argv[1])
+    export(*export_args)
@@ -0,0 +1,177 @@
+from typing import Iterator, Tuple, Optional
+import numpy as np
+
+from .tour import tour_array
+
+
+class _array_buffer:
+    """
+    Growable array for appending rows without keeping a python object per entry.
+    """
+    def __init__(self,
+                 width: tuple = (),
+                 dtype: type = np.float64):
+        self._data = np.empty((16,) + width, dtype=dtype)
+        self._size = 0
+
+    def append(self, row):
+        if self._size == len(self._data):
+            grown = np.empty((max(2 * self._size, 16),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self._size] = self._data
+            self._data = grown
+        self._data[self._size] = row
+        self._size += 1
+
+    def view(self) -> np.ndarray:
+        return self._data[:self._size]
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __getstate__(self) -> dict:
+        return {"_data": self.view(), "_size": self._size}
+
+
+class solution_history:
+    LEVELS = ("none", "accepted", "sampled")
+
+    def __init__(self,
+                 init: list,
+                 dist: float,
+                 level: str = "accepted",
+                 every: int = 100):
+        """
+        This class records the course of one iteration of the solver in a compact form. Instead of full copies of the
+        tour, every step is stored as the segment reversals (start, stop) of the order of a utils.tour.tour_array which
+        lead to it from the previous accepted tour. The tours are rebuilt from the initial tour with replay().
+
+        :param init: list [int]
+            Initial order of the tour_array of the iteration
+        :param dist: float
+            Total distance of the initial sequence
+        :param level: str
+            "none" records nothing, "accepted" records all accepted moves, "sampled" records all accepted moves and
+            every k-th evaluated candidate move
+        :param every: int
+            Distance k between two recorded candidate moves for the level "sampled"
+        """
+        if level not in self.LEVELS:
+            raise ValueError("Unknown history level {l}, choose from {o}".format(l=level, o=list(self.LEVELS)))
+        self.level = level
+        self.every = max(int(every), 1)
+        self.init = np.array(init, dtype=np.int32)
+        self.init_dist = dist
+        self._moves = _array_buffer((3,), np.int32)  # Segment reversals as rows (start, stop, step)
+        self._dists = _array_buffer((), np.float64)  # Total distance after each step
+        self._accepted = _array_buffer((), np.bool_)  # Whether the step was accepted or only a candidate
+        self._evaluated = 0  # Number of evaluated candidate moves
+
+    def accept(self,
+               reversals: list,
+               dist: float):
+        """
+        Records an accepted move.
+        :param reversals: list [(int, int)]
+            Segment reversals (start, stop) which make up the move
+        :param dist: float
+            Total distance after the move
+        :return:
+        """
+        if self.level != "none":
+            self._append(reversals, dist, True)
+
+    def evaluate(self,
+                 count: int) -> np.ndarray:
+        """
+        Counts the given number of evaluated candidate moves and returns the offsets of the candidates among them which
+        are to be recorded with candidate().
+        :param count: int
+            Number of evaluated candidate moves
+        :return:
+        offsets: array [int]
+        """
+        if self.level != "sampled":
+            return np.empty(0, dtype=np.intp)
+        offsets = np.arange((-self._evaluated) % self.every, count, self.every)
+        self._evaluated += count
+        return offsets
+
+    def candidate(self,
+                  reversals: list,
+                  dist: float):
+        """
+        Records a candidate move which is not applied to the tour.
+        :param reversals: list [(int, int)]
+            Segment reversals (start, stop) which make up the move
+        :param dist: float
+            Total distance of the candidate
+        :return:
+        """
+        self._append(reversals, dist, False)
+
+    def _append(self,
+                reversals: list,
+                dist: float,
+                accepted: bool):
+        step = len(self._dists)
+        for start, stop in reversals:
+            self._moves.append((start, stop, step))
+        self._dists.append(dist)
+        self._accepted.append(accepted)
+
+    def replay(self,
+               steps: Optional[np.ndarray] = None) -> Iterator[Tuple[np.ndarray, float]]:
+        """
+        Rebuilds the recorded tours one after another.
+        :param steps: array [int]
+            If set, only the tours of these steps (in ascending order) are rebuilt. The moves of the other accepted
+            steps are still applied, but no sequence is created for them.
+        :return:
+        Iterator over the sequence (beginning and ending at the first location of the initial order) and total
+        distance of each recorded step
+        """
+        start = self.init[0] if len(self.init) else 0
+        tour = tour_array(self.init)
+        moves = self._moves.view()
+        dists = self._dists.view()
+        accepted = self._accepted.view()
+        bounds = np.searchsorted(moves[:, 2], np.arange(len(dists) + 1))
+        selected = None
+        if steps is not None:
+            selected = np.zeros(len(dists), dtype=bool)
+            selected[steps] = True
+        for step in range(len(dists)):
+            if selected is not None and not selected[step]:
+                if accepted[step]:
+                    for i, j, _ in moves[bounds[step]:bounds[step + 1]]:
+                        tour.reverse(i, j, shorter=False)
+                continue
+            target = tour if accepted[step] else tour.copy()
+            for i, j, _ in moves[bounds[step]:bounds[step + 1]]:
+                target.reverse(i, j, shorter=False)
+            yield target.sequence(start), dists[step]
+
+    def get_accepted(self) -> np.ndarray:
+        """
+        Returns whether each recorded step is an accepted move (True) or only a sampled candidate (False).
+        :return:
+        accepted: array [bool]
+        """
+        return self._accepted.view()
+
+    def get_sequences(self) -> Tuple[list, list]:
+        """
+        Rebuilds all recorded tours as lists.
+        :return:
+        dists: list [float]
+        sequences: list [list]
+        """
+        dists = []
+        sequences = []
+        for sequence, dist in self.replay():
+            sequences.append(sequence.tolist())
+            dists.append(float(dist))
+        return dists, sequences
+
+    def __len__(self) -> int:
+        return len(self._dists)
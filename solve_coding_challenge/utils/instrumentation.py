@@ -0,0 +1,157 @@
+from typing import Optional, Callable
+from contextlib import contextmanager
+import logging
+import sys
+
+PROFILERS = ("cprofile", "pyinstrument")
+
+
+class solver_stats:
+    def __init__(self,
+                 on_accept: Optional[Callable[[float], None]] = None,
+                 on_sweep: Optional[Callable[[float, float], None]] = None,
+                 on_iteration: Optional[Callable[[int, float, float], None]] = None):
+        """
+        This class collects counters and timings of solvetsp.solve_opt2. It is passed to the solver with the stats
+        argument, without it the solver skips all instrumentation. The counters are plain integers and lists which are
+        updated once per batch of scored moves, so collecting them costs next to nothing compared to the solver.
+
+        The callbacks are called in the process running the solver. With several jobs, the counters and sweep times of
+        the worker processes are merged into this object after each iteration, but on_accept and on_sweep are not
+        called for moves and sweeps in the workers.
+
+        :param on_accept: function (dist)
+            Called with the new total distance after each accepted move
+        :param on_sweep: function (seconds, dist)
+            Called with the duration and the resulting total distance after each sweep
+        :param on_iteration: function (iteration, score, dist)
+            Called with the final score and total distance after each iteration
+        """
+        self.on_accept = on_accept
+        self.on_sweep = on_sweep
+        self.on_iteration = on_iteration
+
+        self.moves_evaluated = 0  # Number of scored moves
+        self.moves_accepted = 0  # Number of applied improving moves
+        self.sweep_times = []  # Duration of each sweep in seconds
+        self.iteration_scores = []  # Score of the last sweep of each iteration
+        self.iteration_dists = []  # Total distance of each iteration
+
+    def add_sweep(self,
+                  seconds: float,
+                  dist: float):
+        """
+        Records a finished sweep.
+        :param seconds: float
+        :param dist: float
+        :return:
+        """
+        self.sweep_times.append(seconds)
+        if self.on_sweep is not None:
+            self.on_sweep(seconds, dist)
+
+    def add_iteration(self,
+                      iteration: int,
+                      score: float,
+                      dist: float):
+        """
+        Records a finished iteration.
+        :param iteration: int
+        :param score: float
+        :param dist: float
+        :return:
+        """
+        self.iteration_scores.append(score)
+        self.iteration_dists.append(dist)
+        if self.on_iteration is not None:
+            self.on_iteration(iteration, score, dist)
+
+    def merge(self,
+              other: "solver_stats"):
+        """
+        Adds the counters and sweep times of another solver_stats (e.g. of a worker process) to this one.
+        :param other: solver_stats
+        :return:
+        """
+        self.moves_evaluated += other.moves_evaluated
+        self.moves_accepted += other.moves_accepted
+        self.sweep_times.extend(other.sweep_times)
+
+    def get_summary(self) -> dict:
+        """
+        Summarizes the collected counters and timings.
+        :return:
+        summary: dict
+        """
+        sweep_time = sum(self.sweep_times)
+        return {"moves_evaluated": self.moves_evaluated,
+                "moves_accepted": self.moves_accepted,
+                "sweeps": len(self.sweep_times),
+                "sweep_time": sweep_time,
+                "moves_per_second": self.moves_evaluated / sweep_time if sweep_time else None,
+                "iterations": len(self.iteration_dists),
+                "iteration_scores": list(self.iteration_scores),
+                "iteration_dists": list(self.iteration_dists)}
+
+    def __getstate__(self) -> dict:
+        # Callbacks are not sent to worker processes
+        state = self.__dict__.copy()
+        state.update(on_accept=None, on_sweep=None, on_iteration=None)
+        return state
+
+
+@contextmanager
+def profiling(profiler: Optional[str] = "cprofile",
+              output: Optional[str] = None,
+              limit: int = 25):
+    """
+    Context manager profiling the enclosed code. The report is written to output (a .prof-file for cProfile, which can
+    be read with pstats or snakeviz, or a html-file for pyinstrument) or printed to stderr if no output is given.
+    :param profiler: str
+        "cprofile", "pyinstrument" or None to disable profiling
+    :param output: str
+        Path of the report
+    :param limit: int
+        Number of functions printed from the cProfile report
+    :return:
+    """
+    if not profiler:
+        yield
+        return
+    if profiler not in PROFILERS:
+        raise ValueError("Unknown profiler {p}, choose from {o}".format(p=profiler, o=list(PROFILERS)))
+
+    if profiler == "pyinstrument":
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logging.error("Could not import pyinstrument, falling back to cProfile")
+            profiler = "cprofile"
+
+    if profiler == "pyinstrument":
+        profile = Profiler()
+        profile.start()
+        try:
+            yield
+        finally:
+            profile.stop()
+            if output:
+                with open(output, "w") as fh:
+                    fh.write(profile.output_html())
+            else:
+                sys.stderr.write(profile.output_text(unicode=True, color=False))
+    else:
+        import cProfile
+        import pstats
+        profile = cProfile.Profile()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            if output:
+                profile.dump_stats(output)
+            else:
+                pstats.Stats(profile, stream=sys.stderr).sort_stats("cumulative").print_stats(limit)
+    if output:
+        logging.warning("Profile written to {p}".format(p=output))
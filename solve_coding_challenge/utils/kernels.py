@@ -0,0 +1,181 @@
+from typing import Optional, Tuple
+import logging
+import math
+import numpy as np
+
+from .spatial import EARTH_RADIUS
+
+KERNELS = ("numpy", "numba", "python")
+
+
+def fill_haversine(matrix: np.ndarray,
+                   lat: np.ndarray,
+                   lon: np.ndarray,
+                   lat_to: np.ndarray,
+                   lon_to: np.ndarray,
+                   square: bool = False):
+    """
+    Fills matrix[i, j] with the circle distance in km between location i of lat and lon and location j of lat_to and
+    lon_to (in radians). The distances are calculated like utils.spatial.haversine, element by element instead of over
+    temporary arrays. The formula is symmetric, so for a square matrix only the pairs i < j are calculated.
+    :param matrix: array [float]
+        Matrix of shape (len(lat), len(lat_to)) to be filled
+    :param lat: array [float]
+    :param lon: array [float]
+    :param lat_to: array [float]
+    :param lon_to: array [float]
+    :param square: bool
+        lat_to and lon_to are lat and lon, the diagonal is set to 0
+    :return:
+    """
+    for i in range(len(lat)):
+        cos_lat = math.cos(lat[i])
+        if square:
+            matrix[i, i] = 0
+        for j in range(i + 1 if square else 0, len(lat_to)):
+            hav = (math.sin((lat_to[j] - lat[i]) / 2) ** 2
+                   + cos_lat * math.cos(lat_to[j]) * math.sin((lon_to[j] - lon[i]) / 2) ** 2)
+            matrix[i, j] = EARTH_RADIUS * 2 * math.asin(math.sqrt(min(hav, 1.0)))
+            if square:
+                matrix[j, i] = matrix[i, j]
+
+
+def tour_sum(order: np.ndarray,
+             d: np.ndarray,
+             start: int,
+             stop: int) -> float:
+    """
+    Sums up the total distance of the closed tour with the reversed segment order[start:stop + 1] (start = stop = 0 for
+    the tour itself), edge by edge from the depot like solvetsp._get_fulldist.
+    :param order: array [int]
+    :param d: array [float]
+    :param start: int
+    :param stop: int
+    :return:
+    dist: float
+    """
+    num = len(order)
+    dist = 0.0
+    prev = order[0]
+    for p in range(1, num + 1):
+        if p == num:
+            loc = order[0]
+        elif start <= p <= stop:
+            loc = order[start + stop - p]
+        else:
+            loc = order[p]
+        dist += d[loc, prev]
+        prev = loc
+    return dist
+
+
+def _make_find_opt2(tour_sum):
+    """
+    Internal function building find_opt2 on the given tour_sum (the compiled one for numba, which can only call
+    compiled functions).
+    """
+    def find_opt2(order: np.ndarray,
+                  d: np.ndarray,
+                  start: int,
+                  stop_min: int,
+                  start_hi: int,
+                  tie: float) -> Tuple[int, int, float, int]:
+        """
+        Searches the next improving 2-opt move (reversal of the segment order[start:stop + 1]) of a sweep, in the order
+        of solvetsp._sweep_opt2: beginning with the move (start, stop_min), all moves of a start position are scored
+        before the next start position, whose scoring begins at stop = start + 1. The search stops at the first
+        improving move or at the start position start_hi. A move whose delta is within tie is improving if the
+        re-summed total distance of the tour gets shorter (see tour_sum), like in solvetsp._sweep_opt2.
+        :param order: array [int]
+            Locations in tour order, with the depot at the first position
+        :param d: array [float]
+            Distance matrix
+        :param start: int
+        :param stop_min: int
+        :param start_hi: int
+        :param tie: float
+            Bound of the rounding error of the deltas, see solvetsp._get_tie
+        :return:
+        start: int
+            Start position of the improving move, start_hi if there is none
+        stop: int
+            Stop position of the improving move, -1 if there is none
+        delta: float
+            Change of the total distance by the move
+        evaluated: int
+            Number of scored moves, counted like solvetsp._sweep_opt2 (all moves of a start position from stop_min on)
+        """
+        num = len(order)
+        evaluated = 0
+        while start < start_hi:
+            a = order[start - 1]
+            b = order[start]
+            removed = d[a, b]
+            for stop in range(stop_min, num):
+                c = order[stop]
+                e = order[stop + 1] if stop + 1 < num else order[0]
+                delta = (d[a, c] + d[b, e]) - (removed + d[c, e])
+                if delta < tie and (delta < -tie or tour_sum(order, d, start, stop) < tour_sum(order, d, 0, 0)):
+                    return start, stop, delta, evaluated + num - stop_min
+            evaluated += num - stop_min
+            start += 1
+            stop_min = start + 1
+        return start, -1, 0.0, evaluated
+    return find_opt2
+
+
+find_opt2 = _make_find_opt2(tour_sum)
+
+
+class kernel_set:
+    def __init__(self,
+                 name: str,
+                 fill_haversine,
+                 find_opt2):
+        """
+        This class holds the kernels of one backend, which replace the NumPy code in the hot loops: fill_haversine
+        computes the distance matrix in utils.load_csv.loadcsv, find_opt2 scores the moves of the full 2-opt sweeps in
+        utils.tsp.solvetsp.
+
+        :param name: str
+            Name of the backend, see KERNELS
+        :param fill_haversine: function
+        :param find_opt2: function
+        """
+        self.name = name
+        self.fill_haversine = fill_haversine
+        self.find_opt2 = find_opt2
+
+
+_loaded = {}  # Name of the backend -> kernel_set, None for NumPy
+
+
+def get_kernels(kernel: str = "numpy") -> Optional[kernel_set]:
+    """
+    Returns the kernels of the given backend. "numba" compiles the loops of this module with numba on their first call
+    (the compiled code is cached next to this module), "python" runs the same loops uncompiled, which is very slow and
+    only meant for checking the kernels against NumPy (see benchmark.py --check_kernels). If numba cannot be imported,
+    the NumPy code is used instead.
+    :param kernel: str
+        "numpy", "numba" or "python"
+    :return:
+    kernels: kernel_set, None for the NumPy code
+    """
+    if kernel not in KERNELS:
+        raise ValueError("Unknown kernel {k}, choose from {o}".format(k=kernel, o=list(KERNELS)))
+    if kernel not in _loaded:
+        if kernel == "python":
+            _loaded[kernel] = kernel_set(kernel, fill_haversine, find_opt2)
+        elif kernel == "numba":
+            try:
+                import numba
+            except ImportError:
+                logging.error("Could not import numba, falling back to the numpy kernels")
+                numba = None
+            # Compiled without numba's threads, which are not safe with the forked worker processes of the solver:
+            _loaded[kernel] = None if numba is None else kernel_set(
+                kernel, numba.njit(cache=True)(fill_haversine),
+                numba.njit(cache=True)(_make_find_opt2(numba.njit(cache=True)(tour_sum))))
+        else:
+            _loaded[kernel] = None
+    return _loaded[kernel]
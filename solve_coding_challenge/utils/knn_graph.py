@@ -0,0 +1,72 @@
+from typing import Tuple, Optional
+import logging
+import numpy as np
+
+from .spatial import grid_index, EARTH_RADIUS
+
+
+class knn_graph:
+    def __init__(self,
+                 lat: np.ndarray,
+                 lon: np.ndarray,
+                 k: int = 10,
+                 index: Optional[grid_index] = None):
+        """
+        This class replaces the dense distance matrix for instances which are too big to hold n x n distances. Only the
+        k nearest neighbours of each location are precomputed (with utils.spatial.grid_index), all other distances are
+        calculated on demand from the coordinates. Indexing works like on the dense matrix, e.g. graph[a, c] with a
+        location a and an array of locations c, so the solver runs on it without copying any matrix.
+
+        :param lat: array [float]
+            Latitudes in radians
+        :param lon: array [float]
+            Longitudes in radians
+        :param k: int
+            Number of neighbours per location
+        :param index: grid_index
+            Spatial index over the same coordinates, built here if not given
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        # Precomputed terms of the haversine formula, the lookups on small arrays are dominated by the number of steps:
+        self._half_lat = self.lat / 2
+        self._half_lon = self.lon / 2
+        self._cos_lat = np.cos(self.lat)
+        self.num = len(self.lat)
+        self.shape = (self.num, self.num)
+        self.dtype = np.dtype(np.float64)
+        if index is None:
+            index = grid_index(self.lat, self.lon)
+        self.neighbors, _ = index.knn_all(k)  # Neighbours of each location sorted by distance
+        self.neighbor_dists = self[np.arange(self.num)[:, None], self.neighbors]  # Distances to the neighbours in km
+        logging.debug("Built {k}-nearest-neighbour graph of {n} locations".format(k=self.neighbors.shape[1],
+                                                                                  n=self.num))
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+    @property
+    def nbytes(self) -> int:
+        return sum(array.nbytes for array in (self.lat, self.lon, self._half_lat, self._half_lon, self._cos_lat,
+                                              self.neighbors, self.neighbor_dists))
+
+    def __getitem__(self,
+                    key: Tuple[np.ndarray, np.ndarray]) -> np.ndarray:
+        """
+        Calculates the distances in km between the locations i and j of key = (i, j), broadcast against each other.
+        :param key: tuple (int or array [int], int or array [int])
+        :return:
+        dist: float or array [float]
+        """
+        if not isinstance(key, tuple) or len(key) != 2:
+            raise IndexError("knn_graph only supports indexing with a pair of locations (i, j)")
+        i, j = key
+        # Scalars take the same numpy functions as arrays, so a distance never depends on how it is looked up:
+        sin_lat = np.sin(self._half_lat[j] - self._half_lat[i])
+        sin_lon = np.sin(self._half_lon[j] - self._half_lon[i])
+        hav = sin_lat * sin_lat + self._cos_lat[i] * self._cos_lat[j] * (sin_lon * sin_lon)
+        return (2 * EARTH_RADIUS) * np.arcsin(np.sqrt(np.minimum(hav, 1.0)))
+
+    def __len__(self) -> int:
+        return self.num
@@ -0,0 +1,215 @@
+from typing import Tuple, Optional, Union
+from collections import deque
+import numpy as np
+import time
+
+from .tsp import solvetsp
+from .history import solution_history
+from .tour import tour_array
+from .instrumentation import solver_stats
+from .spatial import grid_index
+from .knn_graph import knn_graph
+
+
+class solvelk(solvetsp):
+    def __init__(self,
+                 dist_frame: Union[np.ndarray, knn_graph],
+                 index: Optional[grid_index] = None,
+                 max_depth: int = 50,
+                 depot: int = 0):
+        """
+        This class solves the traveling salesman problem with a Lin-Kernighan style variable depth search. It works
+        like solvetsp (initial routes, iterations, parallel workers, time limit, history and results), but instead of
+        single 2-opt moves, each location starts a chain of up to max_depth 2-opt moves, which is only kept up to its
+        best intermediate tour. A chain may pass through tours which are longer than the current one, so it escapes
+        many local optima of 2-opt. Locations without an improving chain try the Or-opt moves of the solver operators.
+
+        :param dist_frame: array or knn_graph
+            Array containing the distance matrix for all locations
+        :param index: grid_index
+            Spatial index over the locations, see solvetsp
+        :param max_depth: int
+            Maximum number of 2-opt moves of one chain
+        :param depot: int
+            Location at start and end of every sequence, see solvetsp
+        """
+        super().__init__(dist_frame, index, depot)
+        self.max_depth = max_depth
+
+    def solve_lk(self,
+                 scorethresh: float = 0.001,
+                 iterations: int = 20,
+                 jobs: int = 1,
+                 neighbors: Optional[int] = None,
+                 oropt: bool = True,
+                 history: str = "accepted",
+                 history_every: int = 100,
+                 stats: Optional[solver_stats] = None,
+                 time_limit: Optional[float] = None,
+                 restart: str = "random",
+                 kick_length: int = 50):
+        """
+        This function executes the Lin-Kernighan style search for optimizing the route, see solvetsp.solve_opt2 for
+        the iterations and the further parameters.
+        :param scorethresh: float
+            Lower threshold for the score of each iteration
+        :param iterations: int
+            Number of iteration with new initial route
+        :param jobs: int
+            Number of worker processes running the iterations in parallel
+        :param neighbors: int
+            Number of nearest neighbours of each location which are candidates for the new edges of a chain
+            (DEFAULT_NEIGHBORS if not set)
+        :param oropt: bool
+            Try Or-opt moves at locations without an improving chain
+        :param history: str
+            Level of the recorded history of each iteration
+        :param history_every: int
+            Distance k between two recorded candidate moves for the history level "sampled"
+        :param stats: solver_stats
+            If set, counts the evaluated and accepted moves and times the sweeps
+        :param time_limit: float
+            If set, the iterations are stopped after time_limit seconds with the best sequence found so far
+        :param restart: str
+            "random" for new initial routes, "kick" for an iterated local search with double-bridge kicks
+        :param kick_length: int
+            Maximum length of the three segments moved by a double-bridge kick
+        :return:
+        """
+        self.solve_opt2(scorethresh=scorethresh, iterations=iterations, jobs=jobs,
+                        neighbors=neighbors or self._get_default_neighbors(),
+                        operators=["oropt"] if oropt else ["2opt"], history=history, history_every=history_every,
+                        stats=stats, time_limit=time_limit, restart=restart, kick_length=kick_length)
+
+    def _get_worker_settings(self) -> dict:
+        settings = super()._get_worker_settings()
+        settings["max_depth"] = self.max_depth
+        return settings
+
+    def _sweep_local_search(self,
+                            tour: tour_array,
+                            history: solution_history,
+                            locations: Optional[np.ndarray] = None):
+        """
+        Internal function improving the tour until no location starts an improving chain or operator move. The
+        locations are processed from a queue of don't-look bits like in solvetsp._sweep_local_search, and all
+        locations at the changed edges of an applied chain are queued again.
+        :param tour: tour_array
+            Current tour, modified in place
+        :param history: solution_history
+            History where the accepted chains and moves are recorded
+        :param locations: array [int]
+            Locations queued at the start, all locations of the tour if not set
+        :return:
+        """
+        if locations is None:
+            queue = deque(tour.order.tolist())
+            queued = np.ones(tour.num, dtype=bool)
+        else:
+            queue = deque(np.unique(locations).tolist())
+            queued = np.zeros(tour.num, dtype=bool)
+            queued[list(queue)] = True
+        stats = self.stats
+        deadline = self.deadline
+        while queue:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            t1 = queue.popleft()
+            queued[t1] = False
+
+            delta, changed = self._improve_chain(tour, history, t1)
+            if not delta < 0:
+                for operator in self.operators:
+                    delta, move = operator.find_move(self.dist_matrix, tour, t1, self.neighbors[t1])
+                    if stats is not None:
+                        stats.moves_evaluated += operator.count_moves(self.neighbors.shape[1], tour.num)
+                    if delta < 0:
+                        tour.log = []
+                        changed = operator.apply_move(tour, move) + (t1,)
+                        self.dist += delta
+                        history.accept(tour.log, self.dist)
+                        tour.log = None
+                        break
+            if not delta < 0:
+                continue
+            if stats is not None:
+                stats.moves_accepted += 1
+                if stats.on_accept is not None:
+                    stats.on_accept(self.dist)
+            for x in changed:
+                if not queued[x]:
+                    queued[x] = True
+                    queue.append(x)
+
+    def _improve_chain(self,
+                       tour: tour_array,
+                       history: solution_history,
+                       t1: int) -> Tuple[float, tuple]:
+        """
+        Internal function searching an improving chain of 2-opt moves starting at location t1, for both tour edges of
+        t1. The edge (t1, t2) is removed, and in each step the new edge (t2, t3) to a candidate t3 is added and the
+        edge (t3, t4) is removed, such that closing the tour with (t4, t1) gives a valid tour. The step with the
+        highest remaining gain d(t1, t2) - d(t2, t3) + d(t3, t4) is chosen, only while the partial gain
+        d(t1, t2) - d(t2, t3) is positive, and t4 continues the chain as new t2. Added edges are not removed again.
+        The tour is rolled back to the best closed tour of the chain.
+        :param tour: tour_array
+            Current tour, modified in place if an improving chain is found
+        :param history: solution_history
+            History where an improving chain is recorded as one accepted move
+        :param t1: int
+            Start location of the chain
+        :return:
+        delta: float
+            Change of the total distance (0 if no improving chain was found)
+        changed: tuple [int]
+            Locations whose edges were changed
+        """
+        d = self.dist_matrix
+        stats = self.stats
+        for first in (tour.next(t1), tour.prev(t1)):
+            if tour.num < 5:
+                break
+            t2 = first
+            gain = d[t1, t2]
+            tour.log = []
+            added = set()
+            touched = [t1, t2]
+            best_gain, best_steps, best_log = 0.0, 0, 0
+            for step in range(self.max_depth):
+                t3 = self.neighbors[t2]
+                successor = tour.next(t1) == t2
+                t4 = tour.prev(t3) if successor else tour.next(t3)
+                partial = gain - d[t2, t3]
+                # No edge to t1 or the tour neighbours of t2:
+                offset = (tour.pos[t3] - tour.pos[t2]) % tour.num
+                invalid = (t3 == t1) | (t4 == t1) | (offset == 1) | (offset == tour.num - 1) | ~(partial > 0)
+                if stats is not None:
+                    stats.moves_evaluated += len(t3)
+                value = np.where(invalid, -np.inf, partial + d[t3, t4])
+                # Best step which does not remove an added edge:
+                ind = int(np.argmax(value))
+                while value[ind] > -np.inf and (min(t3[ind], t4[ind]), max(t3[ind], t4[ind])) in added:
+                    value[ind] = -np.inf
+                    ind = int(np.argmax(value))
+                if value[ind] == -np.inf:
+                    break
+                t3, t4 = int(t3[ind]), int(t4[ind])
+                tour.two_opt_move(t1, t2, t4, t3)
+                added.add((min(t2, t3), max(t2, t3)))
+                touched += [t3, t4]
+                gain = float(value[ind])
+                closed = gain - d[t4, t1]
+                if closed > best_gain + 1e-10:
+                    best_gain, best_steps, best_log = closed, step + 1, len(tour.log)
+                t2 = t4
+
+            # Roll back the steps behind the best closed tour:
+            for i, j in reversed(tour.log[best_log:]):
+                tour.reverse(i, j, shorter=False)
+            if best_steps:
+                self.dist -= best_gain
+                history.accept(tour.log[:best_log], self.dist)
+                tour.log = None
+                return -best_gain, tuple(touched[:2 * best_steps + 2])
+            tour.log = None
+        return 0.0, ()
@@ -1,24 +1,80 @@
-from typing import Tuple
-import pandas as pd
+from typing import Tuple, Optional, Union, TYPE_CHECKING
+import numpy as np
 import logging
 from math import cos, sin, asin, radians, sqrt
 
+from .distance_cache import distance_cache
+from .spatial import EARTH_RADIUS, haversine, grid_index
+from .knn_graph import knn_graph
+from .kernels import get_kernels
+from .sites import site_table, read_sites, read_sites_numpy, NAME_COLUMN, LAT_COLUMN, LON_COLUMN
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+METRIC = "haversine:{r}".format(r=EARTH_RADIUS)  # Distance metric used as part of the cache key
+
 
 class loadcsv:
     """
     This class loads and interprets the csv-file with the format, which is stated in the task.
     Further, this class calculates the distances between the locations from the geocoordinates.
     """
+    ENGINES = ("pandas", "numpy")
+
     def __init__(self,
-                 path: str):
+                 path: str,
+                 dtype: type = np.float64,
+                 chunk_size: Optional[int] = None,
+                 cache: Optional[distance_cache] = None,
+                 read_chunk_size: Optional[int] = None,
+                 sparse_k: Optional[int] = None,
+                 engine: str = "pandas",
+                 kernel: str = "numpy"):
         """
         Setup the csv-interpreter.
         :param path: str
             Path to the csv-file
+        :param dtype: type
+            Data type of the distance matrix (np.float64 or np.float32)
+        :param chunk_size: int
+            Number of matrix rows computed per block. If not set, the whole matrix is computed in one shot.
+        :param cache: distance_cache
+            If set, the distance matrix is loaded from or stored in this cache
+        :param read_chunk_size: int
+            If set, the csv-file is streamed in chunks of read_chunk_size rows, and only the names and coordinates are
+            kept as compact arrays (float32 coordinates, see utils.sites.read_sites). If not set, the whole csv-file is
+            parsed into a dataframe.
+        :param sparse_k: int
+            If set, no dense distance matrix is computed. Instead, the distances are provided by a knn_graph holding
+            the sparse_k nearest neighbours of each location and calculating all other distances on demand.
+        :param engine: str
+            "pandas" parses the csv-file into a dataframe, "numpy" reads only the names and coordinates with the csv
+            module into a site_table (see utils.sites.read_sites_numpy), so pandas is not imported as long as only
+            get_arrays is used. Ignored if read_chunk_size is set.
+        :param kernel: str
+            Backend computing the distance matrix: "numpy" or "numba" (compiled loop without temporary arrays, NumPy
+            is used if numba is not installed), see utils.kernels.get_kernels
         """
+        if engine not in self.ENGINES:
+            raise ValueError("Unknown engine {e}, choose one of {c}".format(e=engine, c=self.ENGINES))
         self.path = path
-        self.loadeddata = pd.read_csv(self.path)
-        logging.debug("\n" + str(self.loadeddata))
+        self.dtype = np.dtype(dtype)
+        self.chunk_size = chunk_size
+        self.cache = cache
+        self.read_chunk_size = read_chunk_size
+        self.sparse_k = sparse_k
+        self.engine = engine
+        self.kernels = get_kernels(kernel)
+        self.index = None
+        self.sites = None
+        self.loadeddata = None
+        if self.read_chunk_size:
+            self.sites = read_sites(self.path, self.read_chunk_size)
+        elif self.engine == "numpy":
+            self.sites = read_sites_numpy(self.path)
+        else:
+            self._load_data()
         self.distance_frame = None
 
     def _load_data(self):
@@ -26,23 +82,86 @@ class loadcsv:
         Loads the csv-file into a pandas dataframe.
         :return:
         """
+        import pandas as pd
         self.loadeddata = pd.read_csv(self.path)
         logging.debug("\n" + str(self.loadeddata))
 
+    def _get_coordinates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Internal function returning the coordinates of the locations in radians.
+        :return:
+        lat: array [float]
+        lon: array [float]
+        """
+        if self.read_chunk_size or self.loadeddata is None:
+            return np.radians(self.sites.lat.astype(np.float64)), np.radians(self.sites.lon.astype(np.float64))
+        return np.radians(self.loadeddata["Breitengrad"].to_numpy(dtype=np.float64)), \
+            np.radians(self.loadeddata["Längengrad"].to_numpy(dtype=np.float64))
+
     def _calculate_distances(self):
         """
-        Iterates through the dataframe entries (locations) and calculates the distance to each other location.
-        Result is the distance matrix saved as self.distance_frame.
+        Calculates the distance of each location to each other location by broadcasting the geo coordinates against
+        each other. If self.chunk_size is set, the matrix is filled block by block, so only the intermediates of
+        chunk_size rows are held at once.
+        Result is the symmetric distance matrix saved as self.distance_frame (numpy array of self.dtype). If self.cache
+        is set, the matrix is taken from the cache (as read-only memory map) or computed directly into a new cache file.
+        If self.sparse_k is set, a knn_graph is saved as self.distance_frame instead of the matrix.
         :return:
         """
-        dist_list_glob = []
-        for i1, loc1 in self.loadeddata.iterrows():
-            dist_list_loc = []
-            for i2, loc2 in self.loadeddata.iterrows():
-                dist_list_loc.append(self._get_distance(loc1, loc2))
-            dist_list_glob.append(dist_list_loc)
+        lat, lon = self._get_coordinates()
+        shape = (len(lat), len(lat))
 
-        self.distance_frame = pd.DataFrame(dist_list_glob)
+        if self.sparse_k:
+            self.distance_frame = knn_graph(lat, lon, self.sparse_k, index=self.get_index())
+            return
+
+        if self.cache is None:
+            self.distance_frame = np.empty(shape, dtype=self.dtype)
+            self._fill_distances(self.distance_frame, lat, lon)
+            return
+
+        key = self.cache.get_key(lat, lon, METRIC, self.dtype)
+        self.distance_frame = self.cache.load(key)
+        if self.distance_frame is None:
+            self.distance_frame = self.cache.compute(key, shape, self.dtype,
+                                                     lambda matrix: self._fill_distances(matrix, lat, lon))
+
+    def _fill_distances(self,
+                        matrix: np.ndarray,
+                        lat: np.ndarray,
+                        lon: np.ndarray,
+                        lat_to: Optional[np.ndarray] = None,
+                        lon_to: Optional[np.ndarray] = None):
+        """
+        Fills the given matrix with the distances between all locations, in blocks of self.chunk_size rows (or in one
+        call of the kernel of self.kernels). If lat_to and lon_to are given, the rows hold the distances from the
+        locations of lat and lon to the locations of lat_to and lon_to instead.
+        :param matrix: array
+            Matrix of shape (n, n), or (n, m) with lat_to and lon_to, to be filled
+        :param lat: array [float]
+            Latitudes in radians
+        :param lon: array [float]
+            Longitudes in radians
+        :param lat_to: array [float]
+            Latitudes of the columns in radians
+        :param lon_to: array [float]
+            Longitudes of the columns in radians
+        :return:
+        """
+        square = lat_to is None
+        if square:
+            lat_to, lon_to = lat, lon
+        if self.kernels is not None:
+            # The kernel writes the distances without temporary arrays, so no blocks are needed:
+            self.kernels.fill_haversine(np.asarray(matrix), lat, lon, lat_to, lon_to, square)
+            return
+        num = len(lat)
+        chunk_size = self.chunk_size or max(num, 1)
+        for lo in range(0, num, chunk_size):
+            hi = min(lo + chunk_size, num)
+            matrix[lo:hi] = haversine(lat[lo:hi, None], lon[lo:hi, None], lat_to[None, :], lon_to[None, :])
+        if square:
+            np.fill_diagonal(matrix, 0)
 
     def _get_distance(self,
                       loc1: dict,
@@ -69,16 +188,153 @@ class loadcsv:
         dist = 6371.0 * 2 * asin(sqrt(sin(diff_lat / 2) ** 2 + cos(lat1) * cos(lat2) * sin(diff_lon / 2) ** 2))
         return dist
 
-    def get_data(self) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    def get_data(self) -> Tuple["pd.DataFrame", Union[np.ndarray, knn_graph]]:
         """
         This function executes the other internal functions and returns the internal dataframe objects which
-        contain the location-infos and distances.
+        contain the location-infos and distances. The csv-file parsed in __init__ is not read again. If the csv-file
+        was streamed or read with the engine "numpy", the dataframe only contains the names and coordinates.
         :return:
         loadeddata: dataframe,
             Dataframe containing the general info for each location
-        distance_frame: dataframe,
-            Dataframe containing the distance matrix for all locations
+        distance_frame: array or knn_graph,
+            Array containing the distance matrix for all locations (knn_graph if sparse_k is set)
         """
-        self._load_data()
-        self._calculate_distances()
+        if self.loadeddata is None:
+            if self.sites is not None:
+                self.loadeddata = self.sites.to_frame()
+            else:
+                self._load_data()
+        if self.distance_frame is None:
+            self._calculate_distances()
         return self.loadeddata, self.distance_frame
+
+    def get_arrays(self) -> Tuple[site_table, Union[np.ndarray, knn_graph]]:
+        """
+        This function works like get_data, but returns the locations as site_table instead of a dataframe. With the
+        engine "numpy", no dataframe is created and pandas is not needed.
+        :return:
+        sites: site_table
+            Names and coordinates of the locations
+        distance_frame: array or knn_graph,
+            Array containing the distance matrix for all locations (knn_graph if sparse_k is set)
+        """
+        if self.distance_frame is None:
+            self._calculate_distances()
+        return self.get_sites(), self.distance_frame
+
+    def get_subset(self,
+                   sites: list) -> Tuple[np.ndarray, Union[np.ndarray, knn_graph], grid_index]:
+        """
+        This function returns the distances between a subset of the locations, taken from the distance matrix of all
+        locations, which is only computed once for all subsets. If the subset is a contiguous range of locations, the
+        matrix is a view of the full matrix without copying, otherwise the rows and columns of the subset are gathered
+        (m x m values for m locations). With sparse_k, a knn_graph over the subset is built instead.
+        :param sites: list [int]
+            Numbers (rows) of the locations, duplicates are dropped
+        :return:
+        ids: array [int]
+            Sorted numbers of the locations of the subset, location i of the matrix is ids[i]
+        distance_frame: array or knn_graph
+            Distances between the locations of the subset
+        index: grid_index
+            Spatial index over the locations of the subset
+        """
+        if self.distance_frame is None:
+            self._calculate_distances()
+        num = len(self.distance_frame)
+        ids = np.unique(np.asarray(sites, dtype=np.intp))
+        if not len(ids) or ids[0] < 0 or ids[-1] >= num:
+            raise ValueError("Sites have to be numbers between 0 and {n}".format(n=num - 1))
+        lat, lon = self._get_coordinates()
+        index = grid_index(lat[ids], lon[ids]) if len(ids) < num else self.get_index()
+
+        if isinstance(self.distance_frame, knn_graph):
+            return ids, knn_graph(lat[ids], lon[ids], min(self.sparse_k, len(ids) - 1), index=index), index
+        if ids[-1] - ids[0] == len(ids) - 1:
+            return ids, self.distance_frame[ids[0]:ids[-1] + 1, ids[0]:ids[-1] + 1], index
+        return ids, self.distance_frame[np.ix_(ids, ids)], index
+
+    def update_sites(self,
+                     added: Optional["pd.DataFrame"] = None,
+                     removed: Optional[list] = None,
+                     depot: int = 0) -> np.ndarray:
+        """
+        This function applies a change of the location list without reading the csv-file again. The removed locations
+        are dropped and the added ones are appended behind the remaining locations. Only the rows and columns of the
+        added locations are calculated, the distances between the remaining locations are copied from the current
+        matrix (a knn_graph is built again, which only takes O(n log n)). The returned mapping is used to update a
+        previous sequence with utils.tsp.solvetsp.solve_incremental.
+        :param added: dataframe
+            Added locations with the columns of the csv-file ("msg Standort", "Breitengrad", "Längengrad")
+        :param removed: list [int]
+            Numbers (rows) of the removed locations, the depot can't be removed
+        :param depot: int
+            Number (row) of the location at start and end of the tour, see utils.tsp.solvetsp (its new number is
+            mapping[depot])
+        :return:
+        mapping: array [int]
+            New number of each location before the update, -1 for removed locations
+        """
+        import pandas as pd
+        data, matrix = self.get_data()
+        num = len(data)
+        keep = np.ones(num, dtype=bool)
+        if removed is not None and len(removed):
+            removed = np.asarray(removed, dtype=np.intp)
+            if removed.min() < 0 or removed.max() >= num:
+                raise ValueError("Removed locations have to be numbers between 0 and {n}".format(n=num - 1))
+            if (removed == depot).any():
+                raise ValueError("The depot (location {d}) can't be removed".format(d=depot))
+            keep[removed] = False
+        mapping = np.full(num, -1, dtype=np.intp)
+        mapping[keep] = np.arange(keep.sum())
+
+        frames = [data[keep]]
+        if added is not None and len(added):
+            frames.append(added[[NAME_COLUMN, LAT_COLUMN, LON_COLUMN]])
+        self.loadeddata = pd.concat(frames, ignore_index=True)
+        self.sites = None
+        if self.read_chunk_size:
+            self.sites = self.get_sites()
+            self.loadeddata = self.sites.to_frame()  # Coordinates as compact as the streamed ones
+        self.index = None
+
+        if isinstance(matrix, knn_graph):
+            self._calculate_distances()
+        else:
+            lat, lon = self._get_coordinates()
+            count = int(keep.sum())
+            self.distance_frame = np.empty((len(lat), len(lat)), dtype=self.dtype)
+            self.distance_frame[:count, :count] = matrix[np.ix_(keep, keep)]
+            # Rows and columns of the added locations:
+            self._fill_distances(self.distance_frame[count:], lat[count:], lon[count:], lat, lon)
+            self.distance_frame[:count, count:] = self.distance_frame[count:, :count].T
+        logging.debug("Removed {r} and added {a} locations".format(r=num - int(keep.sum()),
+                                                                   a=len(self.loadeddata) - int(keep.sum())))
+        return mapping
+
+    def get_index(self) -> grid_index:
+        """
+        This function returns a spatial index over the locations for nearest neighbour and radius queries. The index is
+        built on the first call.
+        :return:
+        index: grid_index
+        """
+        if self.index is None:
+            self.index = grid_index(*self._get_coordinates())
+        return self.index
+
+    def get_sites(self) -> site_table:
+        """
+        This function returns the locations as compact arrays. If the csv-file was parsed into a dataframe, the
+        site_table is created from it.
+        :return:
+        sites: site_table
+        """
+        if self.sites is None:
+            import pandas as pd
+            codes, names = pd.factorize(self.loadeddata["msg Standort"])
+            self.sites = site_table(codes.astype(np.int32), names.tolist(),
+                                    self.loadeddata["Breitengrad"].to_numpy(dtype=np.float32),
+                                    self.loadeddata["Längengrad"].to_numpy(dtype=np.float32))
+        return self.sites
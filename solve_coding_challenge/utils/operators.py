@@ -0,0 +1,235 @@
+from typing import Tuple, Optional
+import numpy as np
+
+from .tour import tour_array
+
+
+class operator_base:
+    """
+    Base class of the local search operators used by solvetsp. An operator searches the best move which adds an edge
+    between a location and one of its candidate locations, and applies a chosen move to the tour in place.
+
+    Moves work on a utils.tour.tour_array and are formulated on the edges of the tour, so they do not depend on the
+    orientation or the start of the order.
+    """
+    name = None
+
+    def find_move(self,
+                  d: np.ndarray,
+                  tour: tour_array,
+                  a: int,
+                  candidates: np.ndarray) -> Tuple[float, Optional[tuple]]:
+        """
+        Scores all moves of this operator which join the location a with one of the candidates, each in O(1) from the
+        changed edges.
+        :param d: array
+            Distance matrix
+        :param tour: tour_array
+            Current tour
+        :param a: int
+            Location the moves are searched for
+        :param candidates: array [int]
+            Locations which may be joined with a (without a itself)
+        :return:
+        delta: float
+            Change of the total distance by the best move (inf if there is no valid move)
+        move: tuple
+            Description of the best move, which is passed to apply_move
+        """
+        raise NotImplementedError
+
+    def apply_move(self,
+                   tour: tour_array,
+                   move: tuple) -> tuple:
+        """
+        Applies the given move to the tour in place.
+        :param tour: tour_array
+        :param move: tuple
+            Move as returned by find_move
+        :return:
+        changed: tuple [int]
+            Locations whose edges were changed by the move
+        """
+        raise NotImplementedError
+
+    def count_moves(self,
+                    num_candidates: int,
+                    num: int) -> int:
+        """
+        Returns the number of moves scored by find_move for the given number of candidates, which is counted by the
+        solver instrumentation (see utils.instrumentation.solver_stats).
+        :param num_candidates: int
+        :param num: int
+            Number of locations of the tour
+        :return:
+        count: int
+        """
+        return num_candidates
+
+
+class operator_opt2(operator_base):
+    """
+    2-opt: Replaces the edges (a, succ a), (c, succ c) by (a, c), (succ a, succ c), or the analogous edges with the
+    predecessors, by reversing the path in between.
+    """
+    name = "2opt"
+
+    def find_move(self,
+                  d: np.ndarray,
+                  tour: tour_array,
+                  a: int,
+                  candidates: np.ndarray) -> Tuple[float, Optional[tuple]]:
+        if not len(candidates):
+            return np.inf, None  # A tour of only one or two locations has no neighbours to join
+        c = candidates
+
+        # Moves with the successors:
+        succ_a = tour.next(a)
+        succ_c = tour.next(c)
+        delta_succ = (d[a, c] + d[succ_a, succ_c]) - (d[a, succ_a] + d[c, succ_c])
+        # Moves with the predecessors:
+        pred_a = tour.prev(a)
+        pred_c = tour.prev(c)
+        delta_pred = (d[a, c] + d[pred_a, pred_c]) - (d[a, pred_a] + d[c, pred_c])
+
+        best_succ = np.argmin(delta_succ)
+        best_pred = np.argmin(delta_pred)
+        if delta_succ[best_succ] <= delta_pred[best_pred]:
+            return delta_succ[best_succ], (a, succ_a, c[best_succ], succ_c[best_succ])
+        return delta_pred[best_pred], (a, pred_a, c[best_pred], pred_c[best_pred])
+
+    def apply_move(self,
+                   tour: tour_array,
+                   move: tuple) -> tuple:
+        tour.two_opt_move(*move)
+        return move
+
+    def count_moves(self,
+                    num_candidates: int,
+                    num: int) -> int:
+        return 2 * num_candidates
+
+
+class operator_segment_insertion(operator_base):
+    """
+    Segment insertion: Moves a segment of 1 to max_length locations starting or ending at a next to one of the
+    candidates c, either between c and its successor or between its predecessor and c. If reverse is set, the segment
+    may also be inserted in reversed order.
+    """
+    name = "insertion"
+
+    def __init__(self,
+                 max_length: int = 3,
+                 reverse: bool = False):
+        """
+        :param max_length: int
+            Maximum number of locations in the moved segment
+        :param reverse: bool
+            Also evaluate inserting the segment in reversed order
+        """
+        self.max_length = max_length
+        self.reverse = reverse
+
+    def find_move(self,
+                  d: np.ndarray,
+                  tour: tour_array,
+                  a: int,
+                  candidates: np.ndarray) -> Tuple[float, Optional[tuple]]:
+        best_delta, best_move = np.inf, None
+        if not len(candidates):
+            return best_delta, best_move
+        num = tour.num
+        c = candidates
+
+        # Insertion edges (u, v) next to the candidates:
+        u = np.concatenate((c, tour.prev(c)))
+        v = tour.next(u)
+        d_uv = d[u, v]
+        pos_u = tour.pos[u]
+
+        i = tour.pos[a]
+        for length in range(1, min(self.max_length, num - 3) + 1):
+            # Segments starting and ending at a:
+            for s in ((i,) if length == 1 else (i, i - length + 1)):
+                first = tour.order[s % num]
+                end = tour.order[(s + length - 1) % num]
+                p = tour.prev(first)
+                q = tour.next(end)
+                removed = d[p, first] + d[end, q]
+                # The insertion edge must not start at p or inside the segment:
+                invalid = (pos_u - tour.pos[p]) % num <= length
+
+                orientations = ((False, first, end), (True, end, first)) if self.reverse else ((False, first, end),)
+                for reverse, head, tail in orientations:
+                    delta = (d[u, head] + d[tail, v] + d[p, q]) - (d_uv + removed)
+                    delta[invalid] = np.inf
+                    ind = np.argmin(delta)
+                    if delta[ind] < best_delta:
+                        best_delta, best_move = delta[ind], (p, first, end, q, u[ind], v[ind], reverse)
+        return best_delta, best_move
+
+    def apply_move(self,
+                   tour: tour_array,
+                   move: tuple) -> tuple:
+        p, first, end, q, u, v, reverse = move
+        # p first..end q .. u v  ->  p u .. q end..first v  ->  p q .. u end..first v:
+        tour.two_opt_move(p, first, u, v)
+        tour.two_opt_move(p, u, q, end)
+        if not reverse:
+            # -> p q .. u first..end v:
+            tour.two_opt_move(u, end, first, v)
+        return p, first, end, q, u, v
+
+    def count_moves(self,
+                    num_candidates: int,
+                    num: int) -> int:
+        # Two insertion edges per candidate, one segment of length 1 and two of each longer length:
+        lengths = max(min(self.max_length, num - 3), 0)
+        segments = 2 * lengths - 1 if lengths else 0
+        return 2 * num_candidates * segments * (2 if self.reverse else 1)
+
+
+class operator_oropt(operator_segment_insertion):
+    """
+    Or-opt: Moves a segment of 1 to 3 locations to another position without reversing it.
+    """
+    name = "oropt"
+
+    def __init__(self,
+                 max_length: int = 3):
+        super().__init__(max_length=max_length, reverse=False)
+
+
+class operator_opt3(operator_segment_insertion):
+    """
+    3-opt segment insertion: Moves a segment of up to max_length locations to another position, in the same or in
+    reversed order.
+    """
+    name = "3opt"
+
+    def __init__(self,
+                 max_length: int = 8):
+        super().__init__(max_length=max_length, reverse=True)
+
+
+OPERATORS = {operator_opt2.name: operator_opt2,
+             operator_oropt.name: operator_oropt,
+             operator_opt3.name: operator_opt3}
+
+
+def get_operators(names: list) -> list:
+    """
+    Creates the operators with the given names (see OPERATORS). Operator instances are passed through.
+    :param names: list [str]
+    :return:
+    operators: list [operator_base]
+    """
+    operators = []
+    for name in names:
+        if isinstance(name, operator_base):
+            operators.append(name)
+        elif name in OPERATORS:
+            operators.append(OPERATORS[name]())
+        else:
+            raise ValueError("Unknown operator {n}, choose from {o}".format(n=name, o=list(OPERATORS)))
+    return operators
@@ -0,0 +1,291 @@
+from typing import Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import socketserver
+import logging
+import random
+import signal
+import json
+import time
+import os
+
+from .load_csv import loadcsv
+from .distance_cache import distance_cache
+from .tsp import solvetsp
+from .lin_kernighan import solvelk
+from .subset import solve_subset
+
+REQUEST_FIELDS = ("path", "sites", "depot", "time_limit", "seed", "iterations", "score", "neighbors", "operators",
+                  "init", "restart", "solver")
+
+
+class site_set_cache:
+    def __init__(self,
+                 max_entries: int = 4,
+                 cache: Optional[distance_cache] = None):
+        """
+        This class keeps the most recently used site sets (loaded csv-files with their distance matrix and spatial
+        index) in memory, so repeated requests on the same csv-file neither parse it nor compute the matrix again. If
+        more than max_entries site sets are loaded, the least recently used one is dropped.
+
+        :param max_entries: int
+            Maximum number of site sets held at once
+        :param cache: distance_cache
+            If set, the distance matrices are loaded from or stored in this cache
+        """
+        self.max_entries = max(max_entries, 1)
+        self.cache = cache
+        self.entries = OrderedDict()  # Realpath of the csv-file -> loadcsv
+
+    def get(self,
+            path: str) -> loadcsv:
+        """
+        Returns the loaded site set of the csv-file, loading it on the first request.
+        :param path: str
+            Path to the csv-file
+        :return:
+        csvloader: loadcsv
+            Loader whose distance matrix and spatial index are computed
+        """
+        key = os.path.realpath(path)
+        csvloader = self.entries.get(key)
+        if csvloader is not None:
+            self.entries.move_to_end(key)
+            return csvloader
+
+        csvloader = loadcsv(key, cache=self.cache, engine="numpy")
+        csvloader.get_arrays()
+        csvloader.get_index()
+        self.entries[key] = csvloader
+        while len(self.entries) > self.max_entries:
+            dropped, _ = self.entries.popitem(last=False)
+            logging.debug("Dropped site set {p}".format(p=dropped))
+        logging.debug("Loaded site set {p}".format(p=key))
+        return csvloader
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+def solve_request(site_sets: site_set_cache,
+                  request: dict) -> dict:
+    """
+    Solves one request on a site set of the cache. The request is a dict with the fields of REQUEST_FIELDS, of which
+    only "path" is required: the csv-file, the numbers of the locations to visit ("sites", all if not set), the
+    location at start and end of the tour ("depot", 0 if not set), the time limit in seconds, the seed of the random
+    module, and the parameters of main.py (iterations, score, neighbors, operators, init, restart, solver). The tour is
+    solved on the distances of the subset taken from the matrix of the site set (see utils.subset.solve_subset).
+    :param site_sets: site_set_cache
+    :param request: dict
+    :return:
+    response: dict
+        Total distance ("dist"), sequence in numbers of the site set ("sequence"), names of the locations in this
+        order ("names") and the solving time in seconds ("seconds")
+    """
+    unknown = set(request) - set(REQUEST_FIELDS)
+    if unknown:
+        raise ValueError("Unknown request field(s) {u}, choose from {o}".format(u=sorted(unknown),
+                                                                              o=list(REQUEST_FIELDS)))
+    if not request.get("path"):
+        raise ValueError("The request needs the path of a csv-file")
+    start = time.perf_counter()
+    csvloader = site_sets.get(request["path"])
+    sites = csvloader.get_arrays()[0]
+
+    if request.get("seed") is not None:
+        random.seed(request["seed"])
+    solver = request.get("solver", "2opt")
+    if solver not in ("2opt", "lk"):
+        raise ValueError("Unknown solver {s}, choose from ['2opt', 'lk']".format(s=solver))
+    parameters = dict(scorethresh=request.get("score", 0.00001), iterations=request.get("iterations", 10),
+                      neighbors=request.get("neighbors", 0), time_limit=request.get("time_limit"),
+                      restart=request.get("restart", "random"), history="none")
+    if solver == "2opt":
+        parameters["operators"] = request.get("operators")
+    sequence, dist, _ = solve_subset(csvloader, request.get("sites"), depot=request.get("depot", 0),
+                                     solver=solvelk if solver == "lk" else solvetsp,
+                                     init=request.get("init", "random"), **parameters)
+    return {"dist": dist,
+            "sequence": sequence,
+            "names": [sites.get_name(s) for s in sequence],
+            "seconds": time.perf_counter() - start}
+
+
+_worker_site_sets = None  # site_set_cache of a worker process of solver_service
+
+
+def _init_worker(max_entries: int,
+                 cache_dir: Optional[str],
+                 cache_bytes: int,
+                 preload: Optional[str]):
+    """
+    Internal function setting up a worker process of solver_service with its own site set cache, in which the default
+    csv-file is loaded right away.
+    """
+    global _worker_site_sets
+    cache = distance_cache(cache_dir, cache_bytes) if cache_dir else None
+    _worker_site_sets = site_set_cache(max_entries, cache)
+    if preload:
+        _worker_site_sets.get(preload)
+
+
+def _warm_up(_: int):
+    """
+    Internal function doing nothing, used to start the worker processes of solver_service.
+    """
+    return None
+
+
+def _solve_request_worker(request: dict) -> Tuple[Optional[dict], Optional[str]]:
+    """
+    Internal function solving a request in a worker process. Invalid requests are returned as error message instead of
+    raising, so the pool is not affected.
+    :return:
+    response: dict, None for an invalid request
+    error: str, None for a valid request
+    """
+    try:
+        return solve_request(_worker_site_sets, request), None
+    except (ValueError, TypeError, OSError) as error:
+        return None, str(error)
+
+
+class solver_service:
+    def __init__(self,
+                 path: Optional[str] = None,
+                 jobs: int = 1,
+                 max_entries: int = 4,
+                 cache: Optional[distance_cache] = None,
+                 defaults: Optional[dict] = None):
+        """
+        This class runs the solver as long-running local service. The requests are solved by a pool of worker
+        processes. Every worker keeps the site sets it has loaded in a site_set_cache, so a request on a loaded csv-file
+        starts solving right away, without importing, parsing or computing the distance matrix again.
+
+        :param path: str
+            Default csv-file of the requests, loaded by every worker at its start
+        :param jobs: int
+            Number of worker processes solving requests at the same time
+        :param max_entries: int
+            Maximum number of site sets held by each worker
+        :param cache: distance_cache
+            If set, the workers load the distance matrices from or store them in this cache, so a site set is only
+            computed once for all workers
+        :param defaults: dict
+            Default values of the request fields (see solve_request)
+        """
+        self.path = path
+        self.defaults = dict(defaults or {})
+        if path:
+            self.defaults["path"] = path
+        self.pool = ProcessPoolExecutor(max_workers=max(jobs, 1), initializer=_init_worker,
+                                        initargs=(max_entries, cache.directory if cache is not None else None,
+                                                  cache.max_bytes if cache is not None else 0, path))
+        # Start all workers (each loading the default csv-file) before the first request:
+        list(self.pool.map(_warm_up, range(max(jobs, 1))))
+        self.server = None
+
+    def solve(self,
+              request: dict) -> dict:
+        """
+        Solves a request on the worker pool, the fields which are not set are taken from the defaults.
+        :param request: dict
+            See solve_request
+        :return:
+        response: dict
+        """
+        response, error = self.pool.submit(_solve_request_worker, {**self.defaults, **request}).result()
+        if error is not None:
+            raise ValueError(error)
+        return response
+
+    def serve(self,
+              address: str = "8000"):
+        """
+        Answers the requests until the service is interrupted. A request is sent as POST to /solve with a JSON object
+        (see solve_request), the response is the JSON object of the result, or {"error": message} with status 400 for
+        an invalid request and 500 if solving failed otherwise.
+        :param address: str
+            Port on localhost (digits), or path of a Unix socket
+        :return:
+        """
+        previous = signal.signal(signal.SIGTERM, _interrupt)  # Stop like on Ctrl+C, so the workers are shut down
+        try:
+            if address.isdigit():
+                self.server = ThreadingHTTPServer(("127.0.0.1", int(address)), _request_handler)
+            else:
+                if os.path.exists(address):
+                    os.remove(address)  # Socket of a previous run
+                self.server = _unix_http_server(address, _request_handler)
+            self.server.service = self
+            logging.warning("Serving solve requests on {a}".format(a=address))
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            signal.signal(signal.SIGTERM, signal.SIG_IGN)  # Don't interrupt the shutdown
+            self.close()
+            signal.signal(signal.SIGTERM, previous)
+
+    def close(self):
+        """
+        Stops the server and the worker processes.
+        :return:
+        """
+        if self.server is not None:
+            self.server.server_close()
+            if isinstance(self.server, _unix_http_server):
+                os.remove(self.server.server_address)
+            self.server = None
+        self.pool.shutdown()
+
+
+def _interrupt(signum: int,
+               frame):
+    """
+    Internal signal handler stopping solver_service.serve. Further signals are ignored while the service shuts down.
+    """
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    raise KeyboardInterrupt
+
+
+class _unix_http_server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    HTTP server on a Unix socket, which handles every request in its own thread like ThreadingHTTPServer.
+    """
+    daemon_threads = True
+
+
+class _request_handler(BaseHTTPRequestHandler):
+    """
+    Internal handler of the HTTP requests of solver_service.
+    """
+    def do_POST(self):
+        if self.path != "/solve":
+            self._send(404, {"error": "Unknown path {p}, use /solve".format(p=self.path)})
+            return
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if not isinstance(request, dict):
+                raise ValueError("The request has to be a JSON object")
+            status, body = 200, self.server.service.solve(request)
+        except ValueError as error:  # Invalid request, includes invalid JSON
+            status, body = 400, {"error": str(error)}
+        except Exception as error:
+            logging.exception("Failed to solve the request")
+            status, body = 500, {"error": "{t}: {e}".format(t=type(error).__name__, e=error)}
+        self._send(status, body)
+
+    def _send(self,
+              status: int,
+              body: dict):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logging.debug("Request: " + format % args)  # No client address on a Unix socket
@@ -0,0 +1,254 @@
+from typing import Iterator, TYPE_CHECKING
+import logging
+import csv
+import sys
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+NAME_COLUMN = "msg Standort"
+LAT_COLUMN = "Breitengrad"
+LON_COLUMN = "Längengrad"
+
+
+class site_table:
+    def __init__(self,
+                 name_codes: np.ndarray,
+                 names: list,
+                 lat: np.ndarray,
+                 lon: np.ndarray):
+        """
+        This class holds the locations of a csv-file in compact typed arrays instead of a dataframe: the coordinates as
+        float arrays and the names as codes into a list of the distinct (interned) names. Use read_sites (or
+        read_sites_numpy without pandas) to create it from a csv-file.
+
+        :param name_codes: array [int]
+            Index of the name of each location in names
+        :param names: list [str]
+            Distinct names
+        :param lat: array [float]
+            Latitudes in degrees
+        :param lon: array [float]
+            Longitudes in degrees
+        """
+        self.name_codes = name_codes
+        self.names = names
+        self.lat = lat
+        self.lon = lon
+
+    def get_name(self,
+                 i: int) -> str:
+        """
+        Returns the name of the location with the given index.
+        :param i: int
+        :return:
+        name: str
+        """
+        return self.names[self.name_codes[i]]
+
+    def to_frame(self) -> "pd.DataFrame":
+        """
+        Creates a dataframe with the columns of the csv-file used by the solver and the visualizations. The names are
+        stored as categorical column, so the strings are not copied per location. The coordinates are converted to
+        float64, which the visualizations can serialize.
+        :return:
+        dataframe
+        """
+        import pandas as pd
+        return pd.DataFrame({NAME_COLUMN: pd.Categorical.from_codes(self.name_codes, self.names),
+                             LAT_COLUMN: self.lat.astype(np.float64),
+                             LON_COLUMN: self.lon.astype(np.float64)})
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+
+def _check_rows(named: np.ndarray,
+                lat: np.ndarray,
+                lon: np.ndarray,
+                lines: np.ndarray,
+                skip_invalid: bool) -> np.ndarray:
+    """
+    Internal function checking rows of the csv-file: the name must not be empty and the coordinates must be valid
+    latitudes and longitudes.
+    :param named: array [bool]
+        True for the rows with a name
+    :param lat: array [float]
+    :param lon: array [float]
+    :param lines: array [int]
+        Line number of each row in the csv-file
+    :param skip_invalid: bool
+        Drop invalid rows with a warning instead of raising a ValueError
+    :return:
+    valid: array [bool]
+        True for the valid rows
+    """
+    valid = named & (np.abs(lat) <= 90) & (np.abs(lon) <= 180)  # False for NaN
+    if valid.all():
+        return valid
+
+    lines = lines[~valid].tolist()
+    message = "Invalid location in line(s) {l}".format(l=lines[:10] + (["..."] if len(lines) > 10 else []))
+    if not skip_invalid:
+        raise ValueError(message)
+    logging.warning(message + ", skipped")
+    return valid
+
+
+def _validate_chunk(chunk: "pd.DataFrame",
+                    first_line: int,
+                    skip_invalid: bool) -> "pd.DataFrame":
+    """
+    Internal function checking the rows of one chunk of the csv-file (see _check_rows).
+    :param chunk: dataframe
+    :param first_line: int
+        Line number of the first row of the chunk in the csv-file
+    :param skip_invalid: bool
+        Drop invalid rows with a warning instead of raising a ValueError
+    :return:
+    chunk: dataframe
+        Valid rows of the chunk
+    """
+    valid = _check_rows(chunk[NAME_COLUMN].notna().to_numpy(), chunk[LAT_COLUMN].to_numpy(),
+                        chunk[LON_COLUMN].to_numpy(), np.arange(len(chunk)) + first_line, skip_invalid)
+    return chunk if valid.all() else chunk[valid]
+
+
+def iter_site_chunks(path: str,
+                     chunk_size: int = 100000,
+                     dtype: type = np.float32,
+                     skip_invalid: bool = False) -> Iterator["pd.DataFrame"]:
+    """
+    Reads the csv-file in chunks of chunk_size rows, parsing only the name and coordinate columns with fixed types.
+    Every chunk is validated as it arrives (see _validate_chunk).
+    :param path: str
+        Path to the csv-file
+    :param chunk_size: int
+        Number of rows parsed at once
+    :param dtype: type
+        Data type of the coordinates
+    :param skip_invalid: bool
+        Drop invalid rows with a warning instead of raising a ValueError
+    :return:
+    Iterator over the validated chunks as dataframes
+    """
+    import pandas as pd
+    reader = pd.read_csv(path,
+                         usecols=[NAME_COLUMN, LAT_COLUMN, LON_COLUMN],
+                         dtype={NAME_COLUMN: str, LAT_COLUMN: dtype, LON_COLUMN: dtype},
+                         chunksize=chunk_size)
+    first_line = 2  # The first line holds the header
+    with reader:
+        for chunk in reader:
+            yield _validate_chunk(chunk, first_line, skip_invalid)
+            first_line += len(chunk)
+
+
+def read_sites(path: str,
+               chunk_size: int = 100000,
+               dtype: type = np.float32,
+               skip_invalid: bool = False) -> site_table:
+    """
+    Reads the locations of the csv-file chunk by chunk into a site_table. Only the current chunk is held as dataframe,
+    the coordinates are appended to typed arrays and every distinct name is stored once.
+    :param path: str
+        Path to the csv-file
+    :param chunk_size: int
+        Number of rows parsed at once
+    :param dtype: type
+        Data type of the coordinates
+    :param skip_invalid: bool
+        Drop invalid rows with a warning instead of raising a ValueError
+    :return:
+    sites: site_table
+    """
+    import pandas as pd
+    lat_chunks = []
+    lon_chunks = []
+    code_chunks = []
+    names = []
+    name_index = {}
+    for chunk in iter_site_chunks(path, chunk_size, dtype, skip_invalid):
+        lat_chunks.append(chunk[LAT_COLUMN].to_numpy(dtype=dtype))
+        lon_chunks.append(chunk[LON_COLUMN].to_numpy(dtype=dtype))
+        # Map the distinct names of the chunk to the codes of all chunks:
+        chunk_codes, chunk_names = pd.factorize(chunk[NAME_COLUMN])
+        mapping = np.empty(len(chunk_names), dtype=np.int32)
+        for i, name in enumerate(chunk_names.tolist()):
+            code = name_index.get(name)
+            if code is None:
+                code = name_index[name] = len(names)
+                names.append(sys.intern(name))
+            mapping[i] = code
+        code_chunks.append(mapping[chunk_codes])
+
+    sites = site_table(np.concatenate(code_chunks) if code_chunks else np.empty(0, dtype=np.int32),
+                       names,
+                       np.concatenate(lat_chunks) if lat_chunks else np.empty(0, dtype=dtype),
+                       np.concatenate(lon_chunks) if lon_chunks else np.empty(0, dtype=dtype))
+    logging.debug("Read {n} locations with {m} distinct names from {p}".format(n=len(sites), m=len(names), p=path))
+    return sites
+
+
+def _to_float(value: str) -> float:
+    """
+    Internal function parsing a coordinate of the csv-file, NaN if it is empty or no number.
+    """
+    try:
+        return float(value)
+    except ValueError:
+        return np.nan
+
+
+def read_sites_numpy(path: str,
+                     dtype: type = np.float64,
+                     skip_invalid: bool = False) -> site_table:
+    """
+    Reads the locations of the csv-file into a site_table with the csv module of the standard library instead of
+    pandas, so neither pandas has to be imported nor a dataframe has to be built. This is faster for a short-lived
+    process solving one small csv-file. The rows are validated like in read_sites.
+    :param path: str
+        Path to the csv-file
+    :param dtype: type
+        Data type of the coordinates
+    :param skip_invalid: bool
+        Drop invalid rows with a warning instead of raising a ValueError
+    :return:
+    sites: site_table
+    """
+    codes = []
+    lat = []
+    lon = []
+    lines = []
+    names = []
+    name_index = {}
+    with open(path, newline="", encoding="utf-8") as file:
+        reader = csv.reader(file)
+        header = next(reader, [])
+        missing = [column for column in (NAME_COLUMN, LAT_COLUMN, LON_COLUMN) if column not in header]
+        if missing:
+            raise ValueError("Column(s) {c} missing in the csv-file {p}".format(c=missing, p=path))
+        columns = [header.index(column) for column in (NAME_COLUMN, LAT_COLUMN, LON_COLUMN)]
+        for row in reader:
+            if not row:
+                continue  # Blank lines are skipped like by pandas
+            name, row_lat, row_lon = (row[c] if c < len(row) else "" for c in columns)
+            code = name_index.get(name, -1) if name else -2
+            if code == -1:
+                code = name_index[name] = len(names)
+                names.append(sys.intern(name))
+            codes.append(code)
+            lat.append(_to_float(row_lat))
+            lon.append(_to_float(row_lon))
+            lines.append(reader.line_num)
+
+    codes = np.array(codes, dtype=np.int32)
+    lat = np.array(lat, dtype=dtype)
+    lon = np.array(lon, dtype=dtype)
+    valid = _check_rows(codes >= 0, lat, lon, np.array(lines, dtype=np.intp), skip_invalid)
+    if not valid.all():
+        codes, lat, lon = codes[valid], lat[valid], lon[valid]
+    sites = site_table(codes, names, lat, lon)
+    logging.debug("Read {n} locations with {m} distinct names from {p}".format(n=len(sites), m=len(names), p=path))
+    return sites
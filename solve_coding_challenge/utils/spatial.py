@@ -0,0 +1,311 @@
+from typing import Tuple, Optional, Union, List, Iterator, TYPE_CHECKING
+import numpy as np
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+EARTH_RADIUS = 6371.0  # Mean earth radius in km
+
+
+def haversine(lat1: np.ndarray,
+              lon1: np.ndarray,
+              lat2: np.ndarray,
+              lon2: np.ndarray) -> np.ndarray:
+    """
+    Vectorized circle distance in km between the given geo coordinates (in radians). The inputs are broadcast against
+    each other, so passing column and row vectors returns the full block of pairwise distances.
+    :param lat1: array [float]
+    :param lon1: array [float]
+    :param lat2: array [float]
+    :param lon2: array [float]
+    :return:
+    dist: array [float]
+        Distances between the given locations in km
+    """
+    diff_lon = lon2 - lon1
+    diff_lat = lat2 - lat1
+    hav = np.sin(diff_lat / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin(diff_lon / 2) ** 2
+    return EARTH_RADIUS * 2 * np.arcsin(np.sqrt(np.minimum(hav, 1.0)))
+
+
+def chord_to_km(chords: np.ndarray) -> np.ndarray:
+    """
+    Converts chord distances on the unit sphere to circle distances in km.
+    :param chords: array [float]
+    :return:
+    dist: array [float]
+    """
+    return 2 * EARTH_RADIUS * np.arcsin(np.minimum(chords / 2, 1.0))
+
+
+def to_unit_vectors(lat: np.ndarray,
+                    lon: np.ndarray) -> np.ndarray:
+    """
+    Converts geo coordinates (in radians) to points on the unit sphere. The straight (chord) distance between two
+    points grows monotonically with their circle distance, so nearest neighbours can be searched in 3d.
+    :param lat: array [float]
+    :param lon: array [float]
+    :return:
+    xyz: array [float] of shape (n, 3)
+    """
+    cos_lat = np.cos(lat)
+    return np.stack((cos_lat * np.cos(lon), cos_lat * np.sin(lon), np.sin(lat)), axis=1)
+
+
+class grid_index:
+    def __init__(self,
+                 lat: np.ndarray,
+                 lon: np.ndarray,
+                 points_per_cell: int = 16):
+        """
+        This class is a spatial index over geo coordinates: the points on the unit sphere are sorted into a uniform 3d
+        grid of cubic cells. A point only has to be compared with the points of the cells around it, so the k nearest
+        neighbours of all n points are found in about O(n log n) instead of scanning the full distance matrix. Besides
+        the neighbours of the indexed locations (knn_all), the closest locations to any coordinates (query_knn) and all
+        locations within a radius (query_radius) can be searched.
+
+        :param lat: array [float]
+            Latitudes in radians
+        :param lon: array [float]
+            Longitudes in radians
+        :param points_per_cell: int
+            Average number of points per occupied cell the cell size is chosen for
+        """
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.xyz = to_unit_vectors(self.lat, self.lon)
+        self.num = len(self.xyz)
+
+        # The points lie on a surface, so the occupied cells scale with the area spanned by the two largest extents:
+        self.origin = self.xyz.min(axis=0) if self.num else np.zeros(3)
+        extents = np.sort(self.xyz.max(axis=0) - self.origin)[::-1] if self.num else np.zeros(3)
+        self.cell_size = float(np.sqrt(extents[0] * extents[1] * points_per_cell / max(self.num, 1)))
+        if not self.cell_size > 0:
+            self.cell_size = max(float(extents[0]), 1.0)
+
+        cells = np.floor((self.xyz - self.origin) / self.cell_size).astype(np.int64)
+        self.shape = cells.max(axis=0) + 1 if self.num else np.ones(3, dtype=np.int64)
+        keys = self._get_keys(cells)
+        self.order = np.argsort(keys, kind="stable")  # Point indices sorted by cell
+        self.keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.cells = cells
+
+    def _get_keys(self,
+                  cells: np.ndarray) -> np.ndarray:
+        return (cells[..., 0] * self.shape[1] + cells[..., 1]) * self.shape[2] + cells[..., 2]
+
+    def _get_candidates(self,
+                        cell: np.ndarray,
+                        ring: int) -> np.ndarray:
+        """
+        Internal function collecting the indices of all points in the cells within ring cells of the given cell.
+        Points outside these cells are at least ring * cell_size away from any point of the given cell.
+        :param cell: array [int]
+            Grid position of the cell
+        :param ring: int
+        :return:
+        candidates: array [int]
+        """
+        lo = np.maximum(cell - ring, 0)
+        hi = np.minimum(cell + ring, self.shape - 1)
+        grid = np.stack(np.meshgrid(*[np.arange(l, h + 1) for l, h in zip(lo, hi)], indexing="ij"), axis=-1)
+        keys = self._get_keys(grid.reshape(-1, 3))
+        found = np.searchsorted(self.keys, keys)
+        valid = found < len(self.keys)
+        found = found[valid][self.keys[found[valid]] == keys[valid]]
+        # Concatenate the ranges of the found cells in self.order:
+        counts = self.counts[found]
+        offsets = np.repeat(self.starts[found] - np.cumsum(counts) + counts, counts)
+        return self.order[offsets + np.arange(counts.sum())]
+
+    @classmethod
+    def from_frame(cls,
+                   dataframe: "pd.DataFrame",
+                   points_per_cell: int = 16) -> "grid_index":
+        """
+        Builds the index over the locations of a dataframe in the format of the csv-file (coordinates in degrees).
+        :param dataframe: dataframe
+        :param points_per_cell: int
+        :return:
+        index: grid_index
+        """
+        return cls(np.radians(dataframe["Breitengrad"].to_numpy(dtype=np.float64)),
+                   np.radians(dataframe["Längengrad"].to_numpy(dtype=np.float64)),
+                   points_per_cell)
+
+    def _locate(self,
+                xyz: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Internal function finding the grid cells of the given points. Points outside the grid are assigned to the
+        nearest cell at its border.
+        :param xyz: array [float] of shape (m, 3)
+        :return:
+        cells: array [int] of shape (m, 3)
+        offsets: array [float]
+            Distance of each point to its cell (0 for points inside the grid), by which the radius covered by the cells
+            around it shrinks
+        """
+        cells = np.floor((xyz - self.origin) / self.cell_size)
+        cells = np.clip(cells, 0, self.shape - 1).astype(np.int64)
+        lo = self.origin + cells * self.cell_size
+        offsets = np.linalg.norm(xyz - np.clip(xyz, lo, lo + self.cell_size), axis=1)
+        return cells, offsets
+
+    def _group_by_cell(self,
+                       cells: np.ndarray) -> Iterator[np.ndarray]:
+        """
+        Internal generator over the indices of the given cell positions, grouped by cell.
+        """
+        keys = self._get_keys(cells)
+        order = np.argsort(keys, kind="stable")
+        bounds = np.append(np.unique(keys[order], return_index=True)[1], len(order))
+        for lo, hi in zip(bounds[:-1], bounds[1:]):
+            yield order[lo:hi]
+
+    def _search_knn(self,
+                    xyz: np.ndarray,
+                    k: int,
+                    exclude: Optional[np.ndarray] = None,
+                    block_size: int = 2 ** 20) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Internal function searching the k nearest indexed points of the given points. The cells around the cell of a
+        point are searched in growing rings, until the k-th nearest candidate lies within the covered radius.
+        :param xyz: array [float] of shape (m, 3)
+            Points on the unit sphere
+        :param k: int
+        :param exclude: array [int]
+            Index of an indexed point per query point which must not be returned (e.g. the point itself)
+        :param block_size: int
+            Maximum number of distances computed at once
+        :return:
+        neighbors: array [int] of shape (m, k)
+        chords: array [float] of shape (m, k)
+        """
+        neighbors = np.empty((len(xyz), k), dtype=np.intp)
+        chords = np.empty((len(xyz), k), dtype=np.float64)
+        if not k or not len(xyz):
+            return neighbors, chords
+
+        cells, offsets = self._locate(xyz)
+        needed = k if exclude is None else k + 1
+        max_ring = int(self.shape.max())
+        for members in self._group_by_cell(cells):
+            cell = cells[members[0]]
+            ring = 1
+            while len(members):
+                if ring >= max_ring:
+                    candidates = np.arange(self.num)
+                else:
+                    candidates = self._get_candidates(cell, ring)
+                if len(candidates) >= needed or ring >= max_ring:
+                    # Compare the members in batches, so at most about block_size distances are held at once:
+                    batch = max(block_size // len(candidates), 1)
+                    done = np.zeros(len(members), dtype=bool)
+                    for lo in range(0, len(members), batch):
+                        batch_members = members[lo:lo + batch]
+                        dist = np.linalg.norm(xyz[batch_members, None, :] - self.xyz[None, candidates, :], axis=2)
+                        if exclude is not None:
+                            dist[candidates[None, :] == exclude[batch_members, None]] = np.inf
+                        nearest = np.argpartition(dist, k - 1, axis=1)[:, :k]
+                        nearest_dist = np.take_along_axis(dist, nearest, axis=1)
+                        sort = np.argsort(nearest_dist, axis=1, kind="stable")
+                        nearest = np.take_along_axis(nearest, sort, axis=1)
+                        nearest_dist = np.take_along_axis(nearest_dist, sort, axis=1)
+                        # Only neighbours within the covered radius are certain, search farther for the others:
+                        found = (nearest_dist[:, -1] <= ring * self.cell_size - offsets[batch_members]) | \
+                                (ring >= max_ring)
+                        neighbors[batch_members[found]] = candidates[nearest[found]]
+                        chords[batch_members[found]] = nearest_dist[found]
+                        done[lo:lo + batch] = found
+                    members = members[~done]
+                ring *= 2
+        return neighbors, chords
+
+    def knn_all(self,
+                k: int,
+                block_size: int = 2 ** 20) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the k nearest neighbours of every indexed point (without the point itself).
+        :param k: int
+            Number of neighbours per point (at most n-1)
+        :param block_size: int
+            Maximum number of distances computed at once
+        :return:
+        neighbors: array [int] of shape (n, k)
+            Indices of the neighbours of each point sorted by distance
+        chords: array [float] of shape (n, k)
+            Chord distances on the unit sphere to the neighbours
+        """
+        k = max(min(k, self.num - 1), 0)
+        return self._search_knn(self.xyz, k, np.arange(self.num), block_size)
+
+    def query_knn(self,
+                  lat: Union[float, np.ndarray],
+                  lon: Union[float, np.ndarray],
+                  k: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Searches the k indexed locations closest to each of the given coordinates.
+        :param lat: float or array [float]
+            Latitudes in radians
+        :param lon: float or array [float]
+            Longitudes in radians
+        :param k: int
+            Number of locations per coordinate (at most n)
+        :return:
+        indices: array [int] of shape (m, k)
+            Indices of the closest locations sorted by distance
+        dists: array [float] of shape (m, k)
+            Distances in km
+        """
+        xyz = to_unit_vectors(np.atleast_1d(np.asarray(lat, dtype=np.float64)),
+                              np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+        indices, chords = self._search_knn(xyz, max(min(k, self.num), 0))
+        return indices, chord_to_km(chords)
+
+    def query_radius(self,
+                     lat: Union[float, np.ndarray],
+                     lon: Union[float, np.ndarray],
+                     radius: float,
+                     block_size: int = 2 ** 20) -> Tuple[List[np.ndarray], List[np.ndarray]]:
+        """
+        Searches all indexed locations within radius km of each of the given coordinates.
+        :param lat: float or array [float]
+            Latitudes in radians
+        :param lon: float or array [float]
+            Longitudes in radians
+        :param radius: float
+            Radius in km
+        :param block_size: int
+            Maximum number of distances computed at once
+        :return:
+        indices: list [array [int]]
+            Indices of the locations within the radius of each coordinate, sorted by distance
+        dists: list [array [float]]
+            Distances in km
+        """
+        xyz = to_unit_vectors(np.atleast_1d(np.asarray(lat, dtype=np.float64)),
+                              np.atleast_1d(np.asarray(lon, dtype=np.float64)))
+        indices = [np.empty(0, dtype=np.intp)] * len(xyz)
+        dists = [np.empty(0, dtype=np.float64)] * len(xyz)
+        if not self.num:
+            return indices, dists
+
+        chord_radius = 2 * np.sin(min(radius / (2 * EARTH_RADIUS), np.pi / 2))
+        cells, offsets = self._locate(xyz)
+        max_ring = int(self.shape.max())
+        for members in self._group_by_cell(cells):
+            ring = max(int(np.ceil((chord_radius + offsets[members].max()) / self.cell_size)), 1)
+            if ring >= max_ring:
+                candidates = np.arange(self.num)
+            else:
+                candidates = self._get_candidates(cells[members[0]], ring)
+            batch = max(block_size // max(len(candidates), 1), 1)
+            for lo in range(0, len(members), batch):
+                batch_members = members[lo:lo + batch]
+                dist = chord_to_km(np.linalg.norm(xyz[batch_members, None, :] - self.xyz[None, candidates, :], axis=2))
+                for m, row in zip(batch_members, dist):
+                    inside = np.flatnonzero(row <= radius)
+                    inside = inside[np.argsort(row[inside], kind="stable")]
+                    indices[m] = candidates[inside]
+                    dists[m] = row[inside]
+        return indices, dists
@@ -0,0 +1,48 @@
+from typing import Tuple, Optional
+import numpy as np
+
+from .load_csv import loadcsv
+from .tsp import solvetsp
+from .lin_kernighan import solvelk
+
+
+def solve_subset(csvloader: loadcsv,
+                 sites: Optional[list] = None,
+                 depot: int = 0,
+                 solver: type = solvetsp,
+                 init: str = "random",
+                 **parameters) -> Tuple[list, float, solvetsp]:
+    """
+    Solves the tour over a subset of the locations of a csv-file, starting and ending at the depot. The distances are
+    taken from the distance matrix of all locations of the loader, so many subsets are solved without computing any
+    distance again (see loadcsv.get_subset).
+    :param csvloader: loadcsv
+    :param sites: list [int]
+        Numbers (rows) of the locations to visit, all locations if not set. The depot is always visited.
+    :param depot: int
+        Number of the location at start and end of the tour
+    :param solver: type
+        Class of the solver, solvetsp or utils.lin_kernighan.solvelk
+    :param init: str
+        Construction heuristic of the initial routes, see solvetsp.set_init
+    :param parameters:
+        Parameters of solvetsp.solve_opt2 (or solvelk.solve_lk)
+    :return:
+    sequence: list [int]
+        Best sequence in numbers of the csv-file, beginning and ending at the depot
+    dist: float
+        Total distance of the best sequence
+    tspsolver: solvetsp
+        Solver of the subset, whose results are in the numbers of the subset (sequence[i] = ids[i], see
+        loadcsv.get_subset)
+    """
+    sites = np.arange(len(csvloader.get_arrays()[1])) if sites is None else np.asarray(sites, dtype=np.intp)
+    ids, matrix, index = csvloader.get_subset(np.append(sites, depot))
+    tspsolver = solver(matrix, index=index, depot=int(np.searchsorted(ids, depot)))
+    tspsolver.set_init(rand=True, method=init)
+    if isinstance(tspsolver, solvelk):
+        tspsolver.solve_lk(**parameters)
+    else:
+        tspsolver.solve_opt2(**parameters)
+    sequence, dist = tspsolver.get_result()
+    return ids[sequence].tolist(), float(dist), tspsolver
@@ -0,0 +1,145 @@
+from typing import Union
+import numpy as np
+
+
+class tour_array:
+    def __init__(self,
+                 sequence: Union[list, np.ndarray]):
+        """
+        This class holds a closed tour over the locations 0 to n-1 as an array of the order together with the position
+        index of each location. Successor, predecessor and order queries are answered in O(1) without copying, and
+        accept single locations as well as arrays of locations.
+
+        A segment reversal only rewrites the shorter side of the cycle, since reversing a segment or its complement
+        results in the same tour. This halves the cost of the worst case reversal, and the rewrite itself is a single
+        vectorized copy. The orientation of the order may therefore flip after a reversal, so moves are formulated on
+        edges (see two_opt_move) and the resulting sequence is read with sequence().
+
+        :param sequence: list [int]
+            Order of the locations. A closing repetition of the first location at the end is dropped.
+        """
+        order = np.array(sequence, dtype=np.intp)
+        if len(order) > 1 and order[0] == order[-1]:
+            order = order[:-1]
+        self.order = order  # Locations in tour order
+        self.num = len(order)  # Number of locations
+        self.pos = np.empty(self.num, dtype=np.intp)  # Position of each location in self.order
+        self.pos[order] = np.arange(self.num)
+        self.log = None  # If set to a list, the executed reversals (i, j) are appended
+
+    def next(self,
+             c: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        """
+        Returns the successor of the given location(s).
+        :param c: int or array [int]
+        :return:
+        int or array [int]
+        """
+        return self.order[(self.pos[c] + 1) % self.num]
+
+    def prev(self,
+             c: Union[int, np.ndarray]) -> Union[int, np.ndarray]:
+        """
+        Returns the predecessor of the given location(s).
+        :param c: int or array [int]
+        :return:
+        int or array [int]
+        """
+        return self.order[self.pos[c] - 1]
+
+    def between(self,
+                a: Union[int, np.ndarray],
+                b: Union[int, np.ndarray],
+                c: Union[int, np.ndarray]) -> Union[bool, np.ndarray]:
+        """
+        Checks whether b lies on the path from a to c in tour order (a and c included).
+        :param a: int or array [int]
+        :param b: int or array [int]
+        :param c: int or array [int]
+        :return:
+        bool or array [bool]
+        """
+        pa, pb, pc = self.pos[a], self.pos[b], self.pos[c]
+        return np.where(pa <= pc, (pa <= pb) & (pb <= pc), (pb >= pa) | (pb <= pc))
+
+    def reverse(self,
+                i: int,
+                j: int,
+                shorter: bool = True):
+        """
+        Reverses the segment from position i to position j (included, wrapping around the end of the order).
+        :param i: int
+        :param j: int
+        :param shorter: bool
+            Reverse the complement instead if it is shorter. Disable to reproduce recorded reversals exactly.
+        :return:
+        """
+        length = (j - i) % self.num + 1
+        if shorter and 2 * length > self.num:
+            i, j = (j + 1) % self.num, (i - 1) % self.num
+            length = self.num - length
+        if length < 2:
+            return
+        if i <= j:
+            segment = self.order[i:j + 1][::-1].copy()
+            self.order[i:j + 1] = segment
+            self.pos[segment] = np.arange(i, j + 1)
+        else:
+            positions = np.arange(i, i + length) % self.num
+            segment = self.order[positions][::-1]
+            self.order[positions] = segment
+            self.pos[segment] = positions
+        if self.log is not None:
+            self.log.append((i, j))
+
+    def reverse_path(self,
+                     a: int,
+                     b: int):
+        """
+        Reverses the path from location a to location b in tour order.
+        :param a: int
+        :param b: int
+        :return:
+        """
+        self.reverse(self.pos[a], self.pos[b])
+
+    def two_opt_move(self,
+                     a: int,
+                     b: int,
+                     c: int,
+                     d: int):
+        """
+        Replaces the edges (a, b) and (c, d) by (a, c) and (b, d). Either b and d are the successors of a and c, or b
+        and d are their predecessors.
+        :param a: int
+        :param b: int
+        :param c: int
+        :param d: int
+        :return:
+        """
+        if self.next(a) == b:
+            self.reverse_path(b, c)
+        else:
+            self.reverse_path(a, d)
+
+    def sequence(self,
+                 start: int = 0) -> np.ndarray:
+        """
+        Returns the tour as sequence beginning and ending at the given location.
+        :param start: int
+        :return:
+        sequence: array [int]
+        """
+        i = self.pos[start]
+        return np.concatenate((self.order[i:], self.order[:i + 1]))
+
+    def copy(self) -> "tour_array":
+        tour = tour_array.__new__(tour_array)
+        tour.order = self.order.copy()
+        tour.num = self.num
+        tour.pos = self.pos.copy()
+        tour.log = None
+        return tour
+
+    def __len__(self) -> int:
+        return self.num
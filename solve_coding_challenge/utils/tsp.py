@@ -1,37 +1,91 @@
-from typing import Tuple, Optional
+from typing import Tuple, Optional, Iterator, List, Union
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 import numpy as np
-import pandas as pd
 import logging
 import random
+import time
+import os
+
+from .operators import get_operators
+from .history import solution_history
+from .tour import tour_array
+from .instrumentation import solver_stats
+from .knn_graph import knn_graph
+from .spatial import grid_index
+from .kernels import get_kernels
+from .construction import CONSTRUCTIONS, nearest_neighbor, greedy_edge, space_filling_curve, cheapest_insertion, \
+    insert_cheapest
 
 
 class solvetsp:
+    RESTARTS = ("random", "kick")
+    KERNEL_STARTS = 64  # Start positions scored per kernel call before the deadline is checked
+    DEFAULT_NEIGHBORS = 10  # Number of nearest neighbours used if none is given
+
     def __init__(self,
-                 dist_frame: pd.DataFrame):
+                 dist_frame: Union[np.ndarray, knn_graph],
+                 index: Optional[grid_index] = None,
+                 depot: int = 0):
         """
         This class solves the traveling salesman problem with the 2-opt algorithm. As input, the distance matrix must
-        be given in a pandas dataframe.
+        be given as array (or anything np.asarray converts, like a pandas dataframe). For large instances, a
+        utils.knn_graph.knn_graph can be given instead, which calculates the distances on demand and provides the
+        candidate lists of the nearest neighbours.
 
-        :param dist_frame: dataframe
-            Dataframe containing the distance matrix for all locations
+        :param dist_frame: array or knn_graph
+            Array containing the distance matrix for all locations
+        :param index: grid_index
+            Spatial index over the locations (see utils.spatial.grid_index). If given, the candidate lists of the
+            nearest neighbours are searched in the index instead of the rows of the distance matrix.
+        :param depot: int
+            Location at start and end of every sequence (Ismaning by default)
         """
+        if not 0 <= depot < len(dist_frame):
+            raise ValueError("The depot has to be a location between 0 and {n}".format(n=len(dist_frame) - 1))
         self.dist_frame = dist_frame
-        self.num = len(dist_frame) + 1  # Ismaning is at start and end of the list
+        if isinstance(dist_frame, knn_graph):
+            self.dist_matrix = dist_frame  # Distances calculated on demand
+        else:
+            self.dist_matrix = np.asarray(dist_frame)  # Dense array for the O(1) move evaluation
+            if self.dist_matrix.dtype.kind != "f":
+                self.dist_matrix = self.dist_matrix.astype(np.float64)
+        self.num = len(dist_frame) + 1  # The depot is at start and end of the list
+        self.depot = depot  # Location at start and end of every sequence
         self.init = None
+        self.index = index  # Spatial index over the locations
+        self.neighbors = None  # Candidate lists of the k nearest neighbours of each location
+        self.construction_neighbors = None  # Nearest neighbours used by the construction heuristics
+        self.init_method = "random"  # Construction heuristic of the initial routes, see utils.construction
+        self.operators = None  # Local search operators, full 2-opt sweeps if not set
+        self.kernel = "numpy"  # Backend scoring the moves of the full 2-opt sweeps, see utils.kernels
+        self.history_level = "accepted"  # Level of the solution_history recorded for each iteration
+        self.history_every = 100  # Distance between two recorded candidates for the history level "sampled"
+        self.stats = None  # solver_stats collecting counters and timings, no instrumentation if not set
+        self.deadline = None  # Time (time.monotonic) at which the running iteration stops, no limit if not set
         self.set_init()
 
         # Optimize parameter:
         self.sequence = []  # Most recent sequence of locations (in numbers from 0-20)
-        self.sequence_dists = []  # Distances between the locations
         self.dist = 0  # Total distance of the most recent sequence
         self.iterated_dists = []  # List of all calculated total distances over the iterations
         self.iterated_sequences = []  # List of all calculated sequences over the iterations
-        self.best_iterated_sequences = []  # List of all sequences from the iteration with the best final result
-        self.best_iterated_dist = []  # List of all total distances from the iteration with the best final result
+        self.best_history = None  # Recorded solution_history of the iteration with the best result
 
     def solve_opt2(self,
                    scorethresh: int = 0.001,
-                   iterations: int = 20):
+                   iterations: int = 20,
+                   jobs: int = 1,
+                   neighbors: Optional[int] = None,
+                   operators: Optional[list] = None,
+                   history: str = "accepted",
+                   history_every: int = 100,
+                   stats: Optional[solver_stats] = None,
+                   time_limit: Optional[float] = None,
+                   restart: str = "random",
+                   kick_length: int = 50,
+                   kernel: str = "numpy"):
         """
         This function executes the 2-opt algorithm for optimizing the route with the given distance matrix.
         Here, the iterations, which always start with a new random route, can be set. the scorethresh defines the
@@ -42,54 +96,88 @@ class solvetsp:
             Lower threshold for the score of each iteration
         :param iterations: int
             Number of iteration with random initial route
+        :param jobs: int
+            Number of worker processes running the iterations in parallel. 1 runs all iterations in this process,
+            0 or None uses all CPU cores.
+        :param neighbors: int
+            If set, only moves joining a location to one of its k nearest neighbours are evaluated, and only locations
+            next to a recent change are examined again. If not set, all pairs of positions are evaluated, except on a
+            knn_graph, where all neighbours of the graph are used.
+        :param operators: list [str or operator_base]
+            Local search operators combined in each iteration (see utils.operators.OPERATORS, e.g. ["2opt", "oropt",
+            "3opt"]). If not set, only 2-opt is used.
+        :param history: str
+            Level of the recorded history of each iteration: "none", "accepted" (all accepted moves) or "sampled"
+            (all accepted moves and every k-th evaluated candidate move), see utils.history.solution_history
+        :param history_every: int
+            Distance k between two recorded candidate moves for the history level "sampled"
+        :param stats: solver_stats
+            If set, counts the evaluated and accepted moves, times the sweeps and records the score of each iteration,
+            see utils.instrumentation.solver_stats
+        :param time_limit: float
+            If set, the iterations are stopped after time_limit seconds. Each iteration runs until it converges or the
+            time is up, so the following iterations only get the time left over. Iterations are interrupted between
+            two moves, so the best sequence found so far is always returned. Iterations which have not started when
+            the time is up are skipped.
+        :param restart: str
+            Start of the iterations after the first one: "random" starts from a new initial route, "kick" runs an
+            iterated local search, which perturbs the current tour with a double-bridge kick and only optimizes around
+            the kick again (see _run_iterations_kick). The kicks run in this process, regardless of jobs.
+        :param kick_length: int
+            Maximum length of the three segments moved by a double-bridge kick
+        :param kernel: str
+            Backend scoring the moves of the full 2-opt sweeps: "numpy" or "numba" (compiled loop which stops at the
+            first improving move, NumPy is used if numba is not installed), see utils.kernels.get_kernels. The
+            results are identical. Not used with neighbors or operators, or for the history level "sampled".
         :return:
         """
+        if restart not in self.RESTARTS:
+            raise ValueError("Unknown restart {r}, choose from {o}".format(r=restart, o=list(self.RESTARTS)))
+        get_kernels(kernel)  # Fails early for an unknown kernel
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        if neighbors:
+            self.set_neighbors(neighbors)
+        elif isinstance(self.dist_matrix, knn_graph):
+            self.set_neighbors(self.dist_matrix.k)  # Full sweeps would calculate all n x n distances
+        else:
+            self.neighbors = None
+        if operators:
+            self.operators = get_operators(operators)
+        elif self.neighbors is not None:
+            self.operators = get_operators(["2opt"])
+        else:
+            self.operators = None  # Full 2-opt sweeps over all pairs of positions
+        self.history_level = history
+        self.history_every = history_every
+        self.stats = stats
+        self.kernel = kernel
+
         # Get Initial sequence and distance
         self.sequence = self.init
         self.dist, sequence_dist = self._get_fulldist(self.sequence)
         logging.debug("Initial distance set: {d}".format(d=self.dist))
         logging.debug("Initial sequence set: {s}".format(s=self.sequence))
 
-        all_sequences = []
-        all_dists = []
+        if not jobs:
+            jobs = os.cpu_count() or 1
+        if restart == "kick":
+            results = self._run_iterations_kick(scorethresh, iterations, deadline, kick_length)
+        elif jobs == 1 or iterations < 2:
+            results = self._run_iterations(scorethresh, iterations, deadline)
+        else:
+            results = self._run_iterations_parallel(scorethresh, iterations, min(jobs, iterations), deadline)
+
+        best_histories = {}
         # Iterate over the number of iterations:
-        for it in range(iterations):
-            score = 1
-            iteration_sequences = []
-            iteration_dists = []
-            while score > scorethresh:
-                dist_prev = self.dist
-                # Iterate over all parts of the sequence:
-                for start in range(1, self.num - 2):
-                    for stop in range(start + 1, self.num - 1):
-                        # Reorder parts of the sequence:
-                        sequence_new = np.concatenate((self.sequence[0:start],
-                                                       self.sequence[stop:-len(self.sequence) + start - 1:-1],
-                                                       self.sequence[stop + 1:len(self.sequence)])).tolist()
-                        # Calculate new total distance of the resulting sequence:
-                        dist_new, sequence_new_dist = self._get_fulldist(sequence_new)
-                        self.sequence_dists.append(dist_new)
-                        iteration_sequences.append(sequence_new)
-                        iteration_dists.append(dist_new)
-                        # Check if new total distance is smaller than recent total distance and save new best sequence
-                        # and total distance (if not do nothing):
-                        if dist_new < self.dist:
-                            self.sequence = sequence_new
-                            self.dist = dist_new
-                            logging.debug("New best distance set: {d}".format(d=dist_new))
-
-                score = 1 - self.dist / dist_prev
-            # Save best distance and sequence from this iteration:
-            all_sequences.append(iteration_sequences)
-            all_dists.append(iteration_dists)
-            self.iterated_dists.append(self.dist)
-            self.iterated_sequences.append(self.sequence)
-            logging.info("Score of Iteration {i}: {s}, Distance: {d}".format(i=it, s=score, d=self.dist))
-
-            # Start over with new initial sequence:
-            self.set_init(rand=True)
-            self.sequence = self.init
-            self.dist, sequence_dist = self._get_fulldist(self.sequence)
+        for it, (sequence, dist, history, score) in enumerate(results):
+            # Save best distance and sequence from this iteration, keep only the history of the best one so far:
+            if not self.iterated_dists or dist < min(self.iterated_dists):
+                best_histories = {len(self.iterated_dists): history}
+            self.iterated_dists.append(dist)
+            self.iterated_sequences.append(sequence)
+            if stats is not None:
+                stats.add_iteration(it, score, dist)
+            logging.info("Score of Iteration {i}: {s}, Distance: {d}".format(i=it, s=score, d=dist))
 
         # Get best total distance and sequence:
         self.dist = np.min(self.iterated_dists)  # Storing total distance of best iteration
@@ -98,34 +186,688 @@ class solvetsp:
         except ValueError:
             ind = np.where(self.iterated_dists == self.dist)[0]
         self.sequence = self.iterated_sequences[ind]  # Storing sequence from best iteration
-        self.best_iterated_sequences = all_sequences[ind] # Storing all sequences from best iteration
-        self.best_iterated_dist = all_dists[ind]  # Storing all total distances from best iteration
+        self.best_history = best_histories[ind]  # Storing the recorded history from best iteration
         logging.info("Best result: Distance: {d} from Iteration {i}".format(i=ind, d=self.dist))
 
+    def solve_incremental(self,
+                          sequence: list,
+                          mapping: np.ndarray,
+                          neighbors: Optional[int] = None,
+                          operators: Optional[list] = None,
+                          history: str = "accepted",
+                          history_every: int = 100,
+                          stats: Optional[solver_stats] = None,
+                          time_limit: Optional[float] = None):
+        """
+        This function updates a previous best sequence after locations were added or removed (see
+        utils.load_csv.loadcsv.update_sites), instead of solving the changed problem from scratch. The removed
+        locations are dropped from the sequence, the added locations are inserted at their cheapest position, and the
+        local search only starts at the locations around the changes: the neighbours of the removed locations in the
+        previous sequence, the added locations and their neighbours in the new sequence. Further locations are only
+        examined if one of their edges changes. The solver has to be set up with the distance matrix after the update.
+        :param sequence: list [int]
+            Previous sequence with the depot at start and end, in the numbers of the locations before the update
+        :param mapping: array [int]
+            New number of each location before the update, -1 for removed locations. All locations of the distance
+            matrix which do not appear in the mapping are added.
+        :param neighbors: int
+            Number of nearest neighbours per location the moves are restricted to (DEFAULT_NEIGHBORS if not set)
+        :param operators: list [str or operator_base]
+            Local search operators, only 2-opt if not set
+        :param history: str
+            Level of the recorded history, see solve_opt2
+        :param history_every: int
+            Distance k between two recorded candidate moves for the history level "sampled"
+        :param stats: solver_stats
+            If set, counts the evaluated and accepted moves and times the local search
+        :param time_limit: float
+            If set, the local search stops after time_limit seconds with the best sequence found so far
+        :return:
+        """
+        deadline = None if time_limit is None else time.monotonic() + time_limit
+        count = len(self.dist_matrix)
+        mapping = np.asarray(mapping, dtype=np.intp)
+        previous = np.asarray(sequence, dtype=np.intp)
+        if len(previous) > 1 and previous[0] == previous[-1]:
+            previous = previous[:-1]
+        mapped = mapping[previous]
+        if not len(mapped) or mapped[0] != self.depot:
+            raise ValueError("The depot (location {d}) has to stay at the start of the sequence".format(d=self.depot))
+        kept = mapped >= 0
+
+        # Locations next to a removed location in the previous sequence:
+        removed = np.flatnonzero(~kept)
+        affected = np.concatenate((mapped[(removed - 1) % len(mapped)], mapped[(removed + 1) % len(mapped)]))
+        order = mapped[kept]
+        added = np.setdiff1d(np.arange(count), order)
+        order = insert_cheapest(self.dist_matrix, order, added)
+
+        self.set_neighbors(neighbors or self._get_default_neighbors())
+        self.operators = get_operators(operators or ["2opt"])
+        self.history_level = history
+        self.history_every = history_every
+        self.stats = stats
+
+        tour = tour_array(order)
+        locations = np.concatenate((affected[affected >= 0], added, tour.prev(added), tour.next(added)))
+        self.dist, sequence_dist = self._get_fulldist(tour.sequence(self.depot))
+        logging.debug("Inserted {a} and removed {r} locations, distance: {d}".format(a=len(added), r=len(removed),
+                                                                                      d=self.dist))
+        best_history = solution_history(tour.order, self.dist, self.history_level, self.history_every)
+        score = self._optimize(tour, best_history, 0.0, deadline, locations.astype(np.intp))
+        if stats is not None:
+            stats.add_iteration(0, score, self.dist)
+
+        self.iterated_dists = [self.dist]
+        self.iterated_sequences = [self.sequence]
+        self.best_history = best_history
+        logging.info("Incremental result: Distance: {d}".format(d=self.dist))
+
+    def _run_iterations(self,
+                        scorethresh: float,
+                        iterations: int,
+                        deadline: Optional[float] = None) -> Iterator[tuple]:
+        """
+        Internal generator running the iterations one after another in this process. Each iteration starts from
+        self.init, which is set to a new random route (or randomized construction, see set_init) afterwards. If a
+        deadline is set, each iteration runs until it converges or the deadline is reached, and no further iteration
+        is started after the deadline (the first one always runs, so there is a result).
+        :param scorethresh: float
+        :param iterations: int
+        :param deadline: float
+            Time (time.monotonic) at which all iterations have to be finished
+        :return:
+        Iterator over the results of _solve_iteration
+        """
+        for it in range(iterations):
+            if it and deadline is not None and time.monotonic() >= deadline:
+                logging.info("Time limit reached, skipping the last {i} iterations".format(i=iterations - it))
+                return
+            yield self._solve_iteration(self.init, scorethresh, deadline)
+            # Start over with new initial sequence (not needed after the last iteration):
+            if it < iterations - 1:
+                self.set_init(rand=True)
+
+    def _run_iterations_kick(self,
+                             scorethresh: float,
+                             iterations: int,
+                             deadline: Optional[float] = None,
+                             kick_length: int = 50) -> Iterator[tuple]:
+        """
+        Internal generator running an iterated local search. The first iteration optimizes self.init. Every further
+        iteration copies the current tour, perturbs it with a double-bridge kick, which a single 2-opt move can't
+        undo, and optimizes only around the kick: the local search starts at the six locations of the changed edges
+        (full sweeps are run without operators). The result becomes the current tour if it is not
+        longer than the current one. The history of an iteration starts at the current tour and contains the kick.
+        :param scorethresh: float
+        :param iterations: int
+        :param deadline: float
+            Time (time.monotonic) at which all iterations have to be finished. The first iteration may use all of it.
+        :param kick_length: int
+            Maximum length of the three segments moved by a kick
+        :return:
+        Iterator over the results of _solve_iteration
+        """
+        sequence, dist, history, score = self._solve_iteration(self.init, scorethresh, deadline)
+        yield sequence, dist, history, score
+        current, current_dist = sequence, dist
+        for it in range(1, iterations):
+            if deadline is not None and time.monotonic() >= deadline:
+                logging.info("Time limit reached, skipping the last {i} iterations".format(i=iterations - it))
+                return
+            tour = tour_array(current)  # Order beginning with the depot, like the initial routes
+            self.dist = current_dist
+            history = solution_history(tour.order, self.dist, self.history_level, self.history_every)
+            locations = self._double_bridge(tour, history, kick_length)
+            score = self._optimize(tour, history, scorethresh, deadline, locations)
+            # Accept the new tour if it is not worse than the current one:
+            if self.dist <= current_dist:
+                current, current_dist = self.sequence, self.dist
+            yield self.sequence, self.dist, history, score
+
+    def _double_bridge(self,
+                       tour: tour_array,
+                       history: solution_history,
+                       kick_length: int = 50) -> np.ndarray:
+        """
+        Internal function applying a random double-bridge kick to the tour in place: the consecutive segments B and C
+        of the tour A B C D swap places (A C B D), which is done by three reversals. The segments are at most
+        kick_length locations long, so the kick stays local, and at least one of them is longer than one location. The
+        kick is recorded as accepted move of the history.
+        :param tour: tour_array
+            Tour, modified in place
+        :param history: solution_history
+        :param kick_length: int
+            Maximum length of the segments B and C and of the gap between the first and last changed edge
+        :return:
+        locations: array [int]
+            Locations at the changed edges
+        """
+        num = tour.num
+        if num < 8:
+            return np.empty(0, dtype=np.intp)
+        length = max(min(kick_length, (num - 2) // 2), 2)
+        i = random.randrange(num)
+        length_b = random.randint(1, length)
+        length_c = random.randint(1 if length_b > 1 else 2, length)  # Swapping two single locations is a 2-opt move
+        j = (i + length_b) % num  # Last position of B
+        k = (j + length_c) % num  # Last position of C
+        order = tour.order
+        a, b1, b2, c1, c2, e = order[[i, (i + 1) % num, j, (j + 1) % num, k, (k + 1) % num]].tolist()
+        d = self.dist_matrix
+        self.dist += (d[a, c1] + d[c2, b1] + d[b2, e]) - (d[a, b1] + d[b2, c1] + d[c2, e])
+        tour.log = []
+        # A B C D -> A C' B' D -> A C B' D -> A C B D:
+        tour.reverse((i + 1) % num, k, shorter=False)
+        tour.reverse((i + 1) % num, (i + length_c) % num, shorter=False)
+        tour.reverse((i + length_c + 1) % num, k, shorter=False)
+        history.accept(tour.log, self.dist)
+        tour.log = None
+        return np.array([a, b1, b2, c1, c2, e], dtype=np.intp)
+
+    def _run_iterations_parallel(self,
+                                 scorethresh: float,
+                                 iterations: int,
+                                 jobs: int,
+                                 deadline: Optional[float] = None) -> List[tuple]:
+        """
+        Internal function running the iterations in a pool of worker processes. The first iteration starts from
+        self.init, every further one gets its own seed for the random module of the worker, which builds the initial
+        route with set_init (so the construction heuristics run in parallel as well, and the result does not depend on
+        the number of workers). The distance matrix is placed once in shared memory, which the workers attach to
+        instead of receiving a pickled copy per iteration. If a deadline is set, each iteration runs until it converges
+        or the deadline is reached, and iterations starting after the deadline are skipped.
+        :param scorethresh: float
+        :param iterations: int
+        :param jobs: int
+            Number of worker processes
+        :param deadline: float
+            Time (time.monotonic) at which all iterations have to be finished
+        :return:
+        List of the results of _solve_iteration in the order of the iterations, without the skipped ones
+        """
+        inits = [self.init] + [None] * (iterations - 1)  # Built by the workers
+        seeds = [random.getrandbits(32) for _ in range(iterations)]
+
+        if isinstance(self.dist_matrix, knn_graph):
+            # The graph only holds O(n k) values, so the workers receive a copy instead of shared memory:
+            shm = None
+            initargs = (None, None, None, self._get_worker_settings(), self.dist_matrix, type(self))
+        else:
+            shm = shared_memory.SharedMemory(create=True, size=max(self.dist_matrix.nbytes, 1))
+            shared = np.ndarray(self.dist_matrix.shape, dtype=self.dist_matrix.dtype, buffer=shm.buf)
+            shared[:] = self.dist_matrix
+            del shared
+            initargs = (shm.name, self.dist_matrix.shape, self.dist_matrix.dtype.str, self._get_worker_settings(), None,
+                        type(self))
+        try:
+            with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=initargs) as pool:
+                results = []
+                for result, stats in pool.map(_solve_iteration_worker,
+                                              [(init, scorethresh, seed, deadline)
+                                               for init, seed in zip(inits, seeds)]):
+                    if result is None:
+                        continue  # Started after the deadline
+                    results.append(result)
+                    if stats is not None:
+                        self.stats.merge(stats)
+        finally:
+            if shm is not None:
+                shm.close()
+                shm.unlink()
+        if len(results) < iterations:
+            logging.info("Time limit reached, skipped {i} iterations".format(i=iterations - len(results)))
+        return results
+
+    def _get_worker_settings(self) -> dict:
+        """
+        Internal function collecting the solver attributes which the worker processes of _run_iterations_parallel
+        need to run _solve_iteration in the same way.
+        :return:
+        settings: dict
+        """
+        return {"depot": self.depot,
+                "neighbors": self.neighbors,
+                "operators": self.operators,
+                "history_level": self.history_level,
+                "history_every": self.history_every,
+                "kernel": self.kernel,
+                "init_method": self.init_method,
+                "construction_neighbors": self.construction_neighbors,
+                "index": None if self.init_method == "random" else self.index,  # Coordinates of the constructions
+                "stats": None if self.stats is None else solver_stats()}
+
+    def _solve_iteration(self,
+                         init: list,
+                         scorethresh: float,
+                         deadline: Optional[float] = None) -> Tuple[list, float, solution_history, float]:
+        """
+        Internal function optimizing the given initial route with 2-opt sweeps until the score of a sweep drops below
+        scorethresh or the deadline is reached. At the deadline, the running sweep stops before its next move.
+        :param init: list [int]
+            Initial route with the depot at start and end
+        :param scorethresh: float
+        :param deadline: float
+            Time (time.monotonic) at which the iteration stops, no limit if not set
+        :return:
+        sequence: list [int]
+            Best sequence of this iteration
+        dist: float
+            Total distance of the best sequence
+        history: solution_history
+            Recorded moves of this iteration
+        score: float
+            Score of the last sweep
+        """
+        tour = tour_array(init)
+        self.dist, sequence_dist = self._get_fulldist(init)
+        self.sequence = list(init)
+        history = solution_history(tour.order, self.dist, self.history_level, self.history_every)
+        score = self._optimize(tour, history, scorethresh, deadline)
+        return self.sequence, self.dist, history, score
+
+    def _optimize(self,
+                  tour: tour_array,
+                  history: solution_history,
+                  scorethresh: float,
+                  deadline: Optional[float] = None,
+                  locations: Optional[np.ndarray] = None) -> float:
+        """
+        Internal function running sweeps over the given tour until the score of a sweep drops below scorethresh or
+        the deadline is reached. self.dist has to hold the total distance of the tour, and self.dist and
+        self.sequence hold the result afterwards. If locations are given and the solver uses operators, only a single
+        local search starting at these locations is run, which ends in a local optimum by itself.
+        :param tour: tour_array
+            Current tour, modified in place
+        :param history: solution_history
+        :param scorethresh: float
+        :param deadline: float
+            Time (time.monotonic) at which the optimization stops, no limit if not set
+        :param locations: array [int]
+            Locations around a change of an otherwise optimized tour
+        :return:
+        score: float
+            Score of the last sweep
+        """
+        score = 1
+        stats = self.stats
+        self.deadline = deadline
+        while score > scorethresh and (deadline is None or time.monotonic() < deadline):
+            dist_prev = self.dist
+            if stats is not None:
+                sweep_start = time.perf_counter()
+            # Sweep over all parts of the sequence, reversing segments in place on improvement:
+            if self.operators is None:
+                self._sweep_opt2(tour, history)
+            else:
+                self._sweep_local_search(tour, history, locations)
+            # Resum the tour once per sweep to avoid drift from the accumulated deltas:
+            sequence = tour.sequence(self.depot)
+            self.dist, sequence_dist = self._get_fulldist(sequence)
+            self.sequence = sequence.tolist()
+            if stats is not None:
+                stats.add_sweep(time.perf_counter() - sweep_start, self.dist)
+
+            # A tour of only the depot has no distance to improve:
+            score = 1 - self.dist / dist_prev if dist_prev > 0 else 0
+            if locations is not None and self.operators is not None:
+                break
+        return score
+
     def set_init(self,
                  rand: Optional[bool] = True,
-                 init_list: Optional[list] = None):
+                 init_list: Optional[list] = None,
+                 method: Optional[str] = None):
         """
-        This function sets the initial route to a given order (init_list) or randomly. If nothing is set, the order will
-        be set to random.
+        This function sets the initial route to a given order (init_list), randomly or with a construction heuristic
+        (see utils.construction). If nothing is set, the order will be set to random. The method is kept for the new
+        initial routes of the further iterations of solve_opt2, which are built with rand set.
         :param rand: bool
+            With a construction heuristic, use its randomized variant (random start location, perturbed edge lengths
+            or rotated curve)
         :param init_list: list [int]
+        :param method: str
+            "random", "nearest" (nearest neighbour), "greedy" (greedy edge), "hilbert" (space-filling curve, needs the
+            coordinates from a knn_graph or spatial index) or "insertion" (cheapest insertion)
         :return:
         """
+        if method is not None:
+            if method not in CONSTRUCTIONS:
+                raise ValueError("Unknown construction {m}, choose from {o}".format(m=method, o=list(CONSTRUCTIONS)))
+            self.init_method = method
+        if self.init_method != "random" and init_list is None:
+            order = self._construct(self.init_method, rand)
+            # Rotate the tour to the depot and close it:
+            order = np.roll(order, -int(np.flatnonzero(order == self.depot)[0]))
+            self.init = np.append(order, self.depot)
+            return
+
         if rand or init_list is None:
-            # Create random list of numbers between 1 and number of cities minus one:
-            init_list = list(range(1, self.num - 1))
+            # Create random list of all cities except the depot:
+            init_list = [i for i in range(self.num - 1) if i != self.depot]
             random.shuffle(init_list)
         elif init_list is not None and len(init_list) == self.num:
             pass
         else:
             raise ValueError("init_list not set or does not have a length according to the given dist_frame")
 
-        # Put Ismaning at start and end of the list:
-        init_list = np.concatenate(([0], init_list, [0]))
+        # Put the depot at start and end of the list:
+        init_list = np.concatenate(([self.depot], init_list, [self.depot]))
 
         self.init = init_list
 
+    def _construct(self,
+                   method: str,
+                   rand: bool) -> np.ndarray:
+        """
+        Internal function building a tour over all locations with the given construction heuristic.
+        :param method: str
+        :param rand: bool
+            Use the randomized variant of the heuristic
+        :return:
+        order: array [int]
+            All locations in tour order
+        """
+        count = len(self.dist_matrix)
+        start = random.randrange(count) if rand else 0
+        if method == "nearest":
+            return nearest_neighbor(self.dist_matrix, start, self._get_candidate_lists())
+        if method == "greedy":
+            rng = np.random.default_rng(random.getrandbits(32)) if rand else None
+            return greedy_edge(self.dist_matrix, self._get_candidate_lists(), noise=0.1 if rand else 0.0, rng=rng)
+        if method == "hilbert":
+            lat, lon = self._get_coordinates()
+            return space_filling_curve(lat, lon, angle=random.uniform(0, 2 * np.pi) if rand else 0.0)
+        return cheapest_insertion(self.dist_matrix, start)
+
+    def _get_candidate_lists(self) -> np.ndarray:
+        """
+        Internal function returning the nearest neighbours used by the construction heuristics: the candidate lists of
+        the solver if set, otherwise the nearest neighbours of _get_default_neighbors, which are computed once.
+        :return:
+        neighbors: array [int] of shape (n, k)
+        """
+        if self.neighbors is not None:
+            return self.neighbors
+        if self.construction_neighbors is None:
+            self.construction_neighbors = self._find_neighbors(self._get_default_neighbors())
+        return self.construction_neighbors
+
+    def _get_default_neighbors(self) -> int:
+        """
+        Internal function returning the number of nearest neighbours used if none is given: DEFAULT_NEIGHBORS, or all
+        neighbours of a knn_graph holding fewer.
+        :return:
+        k: int
+        """
+        if isinstance(self.dist_matrix, knn_graph):
+            return min(self.DEFAULT_NEIGHBORS, self.dist_matrix.k)
+        return self.DEFAULT_NEIGHBORS
+
+    def _get_coordinates(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Internal function returning the coordinates of the locations (in radians) from the knn_graph or spatial index.
+        :return:
+        lat: array [float]
+        lon: array [float]
+        """
+        if isinstance(self.dist_matrix, knn_graph):
+            return self.dist_matrix.lat, self.dist_matrix.lon
+        if self.index is not None:
+            return self.index.lat, self.index.lon
+        raise ValueError("The coordinates are unknown, pass a spatial index (see utils.spatial.grid_index) to solvetsp")
+
+    def set_neighbors(self,
+                      k: int,
+                      chunk_size: int = 1024):
+        """
+        This function precomputes the candidate lists of the k nearest neighbours of each location from the distance
+        matrix, sorted by distance. The matrix is processed in blocks of chunk_size rows. On a knn_graph, the first k
+        neighbours of the graph are used. If a spatial index is set, the neighbours are searched in the index in about
+        O(n log n) instead.
+        :param k: int
+            Number of neighbours per location
+        :param chunk_size: int
+            Number of rows of the distance matrix processed at once
+        :return:
+        """
+        self.neighbors = self._find_neighbors(k, chunk_size)
+
+    def _find_neighbors(self,
+                        k: int,
+                        chunk_size: int = 1024) -> np.ndarray:
+        """
+        Internal function searching the candidate lists for set_neighbors.
+        :param k: int
+        :param chunk_size: int
+        :return:
+        neighbors: array [int] of shape (n, k)
+        """
+        count = len(self.dist_matrix)
+        k = max(min(k, count - 1), 0)
+        if isinstance(self.dist_matrix, knn_graph):
+            if k > self.dist_matrix.k:
+                logging.warning("Only {g} neighbours in the knn_graph, using these instead of {k}".format(
+                    g=self.dist_matrix.k, k=k))
+            return self.dist_matrix.neighbors[:, :k]
+        if self.index is not None:
+            return self.index.knn_all(k)[0]
+        neighbors = np.empty((count, k), dtype=np.intp)
+        if not k:
+            return neighbors
+        for lo in range(0, count, chunk_size):
+            hi = min(lo + chunk_size, count)
+            block = np.array(self.dist_matrix[lo:hi], dtype=np.float64)
+            block[np.arange(hi - lo), np.arange(lo, hi)] = np.inf  # Exclude the location itself
+            nearest = np.argpartition(block, k - 1, axis=1)[:, :k]
+            order = np.argsort(np.take_along_axis(block, nearest, axis=1), axis=1, kind="stable")
+            neighbors[lo:hi] = np.take_along_axis(nearest, order, axis=1)
+        return neighbors
+
+    def _sweep_opt2(self,
+                    tour: tour_array,
+                    history: solution_history):
+        """
+        Internal function executing one full 2-opt sweep over the given tour, which stops early when self.deadline is
+        reached. Every move (reversal of the segment
+        tour.order[start:stop + 1]) is scored in O(1) from the four affected edges of the distance matrix. All moves of
+        one start position are scored at once, the first improving move is applied as an in place reversal and scoring
+        continues behind it. This visits the moves in the same order as the full re-evaluation of each candidate.
+        A move whose delta is within the rounding error of the total distance (like the reversal of the whole tour) is
+        decided like the full re-evaluation, by comparing the re-summed total distances (see _get_tie and
+        _is_shorter), so the same moves are accepted as before. The depot stays at the first position of tour.order.
+        :param tour: tour_array
+            Current tour, modified in place
+        :param history: solution_history
+            History where the evaluated and accepted moves are recorded
+        :return:
+        """
+        kernels = get_kernels(self.kernel)
+        if kernels is not None and self.history_level != "sampled":
+            self._sweep_opt2_kernel(tour, history, kernels)
+            return
+        d = self.dist_matrix
+        order = tour.order
+        stats = self.stats
+        deadline = self.deadline
+        tie = self._get_tie()
+        for start in range(1, self.num - 2):
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            stop_min = start + 1
+            while stop_min < self.num - 1:
+                a = order[start - 1]
+                b = order[start]
+                c = order[stop_min:]
+                e = np.append(order[stop_min + 1:], order[0])
+                delta = (d[a, c] + d[b, e]) - (d[a, b] + d[c, e])
+                if stats is not None:
+                    stats.moves_evaluated += len(delta)
+                # First improving move, moves within the rounding error are checked on the re-summed tour:
+                improving = None
+                for offset in np.flatnonzero(delta < tie):
+                    if delta[offset] < -tie or self._is_shorter(order, start, stop_min + offset):
+                        improving = offset
+                        break
+                # Record the candidates up to the first improving one, which are sampled by the history:
+                for offset in history.evaluate(len(delta) if improving is None else improving + 1):
+                    history.candidate([(start, stop_min + offset)], self.dist + delta[offset])
+                if improving is None:
+                    break
+                stop = stop_min + improving
+                # Reverse the segment in place and save new best sequence and total distance:
+                tour.reverse(start, stop, shorter=False)
+                self.dist += delta[improving]
+                history.accept([(start, stop)], self.dist)
+                if stats is not None:
+                    stats.moves_accepted += 1
+                    if stats.on_accept is not None:
+                        stats.on_accept(self.dist)
+                stop_min = stop + 1
+
+    def _sweep_opt2_kernel(self,
+                           tour: tour_array,
+                           history: solution_history,
+                           kernels):
+        """
+        Internal function executing one full 2-opt sweep like _sweep_opt2, in which the moves are scored by the kernel
+        kernels.find_opt2 (see utils.kernels). The kernel returns the next improving move, which is applied and recorded
+        here, so the sweep applies the same moves as _sweep_opt2. No candidates are recorded for the history.
+        :param tour: tour_array
+            Current tour, modified in place
+        :param history: solution_history
+            History where the accepted moves are recorded
+        :param kernels: utils.kernels.kernel_set
+        :return:
+        """
+        d = self.dist_matrix
+        order = tour.order
+        stats = self.stats
+        deadline = self.deadline
+        end = self.num - 2  # Last start position + 1
+        # With a deadline, the kernel returns after KERNEL_STARTS start positions at the latest to check the time:
+        step = end if deadline is None else self.KERNEL_STARTS
+        tie = self._get_tie()
+        start, stop_min = 1, 2
+        while start < end:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            start, stop, delta, evaluated = kernels.find_opt2(order, d, start, stop_min, min(start + step, end), tie)
+            if stats is not None:
+                stats.moves_evaluated += evaluated
+            if stop < 0:
+                stop_min = start + 1
+                continue
+            # Reverse the segment in place and save new best sequence and total distance:
+            tour.reverse(start, stop, shorter=False)
+            self.dist += d.dtype.type(delta)  # Same precision as the delta of _sweep_opt2
+            history.accept([(start, stop)], self.dist)
+            if stats is not None:
+                stats.moves_accepted += 1
+                if stats.on_accept is not None:
+                    stats.on_accept(self.dist)
+            stop_min = stop + 1
+
+    def _get_tie(self) -> float:
+        """
+        Internal function returning the bound of the rounding error of a move's delta against the difference of the
+        re-summed total distances. Moves whose delta is within this bound are decided by _is_shorter.
+        :return:
+        tie: float
+        """
+        return 4 * self.num * np.finfo(np.float64).eps * abs(float(self.dist))
+
+    def _is_shorter(self,
+                    order: np.ndarray,
+                    start: int,
+                    stop: int) -> bool:
+        """
+        Internal function checking a move like the full re-evaluation of each candidate: the total distance of the tour
+        with the reversed segment order[start:stop + 1] is summed up and compared with the total distance of the tour.
+        :param order: array [int]
+            Locations in tour order, with the depot at the first position
+        :param start: int
+        :param stop: int
+        :return:
+        shorter: bool
+        """
+        sequence = np.append(order, order[0])
+        dist = self._get_fulldist(sequence)[0]
+        sequence[start:stop + 1] = sequence[start:stop + 1][::-1]
+        return self._get_fulldist(sequence)[0] < dist
+
+    def _sweep_local_search(self,
+                            tour: tour_array,
+                            history: solution_history,
+                            locations: Optional[np.ndarray] = None):
+        """
+        Internal function running the local search operators in self.operators until no location yields an improving
+        move. For each location, the operators are asked in order for their best move joining it to one of its
+        candidates (self.neighbors, or all other locations if not set), and the first improving move is applied.
+        Locations are processed from a queue ("don't-look bits"): a location leaves the queue when it yields no
+        improvement and is only queued again when one of its edges changes. The best move proposed by an operator counts
+        as one evaluated candidate for the history, which is recorded by applying and undoing it. The search stops early
+        when self.deadline is reached.
+        :param tour: tour_array
+            Current tour, modified in place
+        :param history: solution_history
+            History where the evaluated and accepted moves are recorded
+        :param locations: array [int]
+            Locations queued at the start, all locations of the tour if not set
+        :return:
+        """
+        d = self.dist_matrix
+        all_locations = np.arange(tour.num)
+        if locations is None:
+            queue = deque(tour.order.tolist())
+            queued = np.ones(tour.num, dtype=bool)
+        else:
+            queue = deque(np.unique(locations).tolist())
+            queued = np.zeros(tour.num, dtype=bool)
+            queued[list(queue)] = True
+        stats = self.stats
+        deadline = self.deadline
+        while queue:
+            if deadline is not None and time.monotonic() >= deadline:
+                return
+            a = queue.popleft()
+            queued[a] = False
+            if self.neighbors is not None:
+                candidates = self.neighbors[a]
+            else:
+                candidates = np.delete(all_locations, a)
+
+            for operator in self.operators:
+                delta, move = operator.find_move(d, tour, a, candidates)
+                if stats is not None:
+                    stats.moves_evaluated += operator.count_moves(len(candidates), tour.num)
+                if move is not None and len(history.evaluate(1)):
+                    tour.log = []
+                    operator.apply_move(tour, move)
+                    history.candidate(tour.log, self.dist + delta)
+                    for i, j in reversed(tour.log):
+                        tour.reverse(i, j, shorter=False)
+                    tour.log = None
+                if not delta < 0:
+                    continue
+                # Apply the move in place:
+                tour.log = []
+                changed = operator.apply_move(tour, move)
+                self.dist += delta
+                history.accept(tour.log, self.dist)
+                tour.log = None
+                if stats is not None:
+                    stats.moves_accepted += 1
+                    if stats.on_accept is not None:
+                        stats.on_accept(self.dist)
+
+                # Examine the locations at the changed edges again:
+                for x in changed + (a,):
+                    if not queued[x]:
+                        queued[x] = True
+                        queue.append(x)
+                break
+
     def _get_fulldist(self,
                       sequence: list) -> Tuple[float, list]:
         """
@@ -139,9 +881,8 @@ class solvetsp:
         sequence_dist: list [float]
             List of all single distances for the given sequence
         """
-        sequence_dist = []
-        for i in range(len(sequence) - 1):
-            sequence_dist.append(self.dist_frame[sequence[i]][sequence[i + 1]])
+        sequence = np.asarray(sequence, dtype=np.intp)
+        sequence_dist = self.dist_matrix[sequence[1:], sequence[:-1]].tolist()
         fulldist = sum(sequence_dist)
         return fulldist, sequence_dist
 
@@ -157,5 +898,91 @@ class solvetsp:
         """
         return self.sequence, self.dist
 
+    def get_best_history(self) -> solution_history:
+        """
+        This function returns the recorded history of the iteration with the best result.
+        :return:
+        history: solution_history
+        """
+        return self.best_history
+
     def get_best_sequences(self) -> Tuple[list, list]:
-        return self.best_iterated_dist, self.best_iterated_sequences
+        """
+        This function rebuilds the recorded sequences and total distances of the iteration with the best result.
+        :return:
+        dists: list [float]
+        sequences: list [list]
+        """
+        if self.best_history is None:
+            return [], []
+        return self.best_history.get_sequences()
+
+    def get_stats(self) -> Optional[solver_stats]:
+        """
+        This function returns the solver_stats passed to the last call of solve_opt2.
+        :return:
+        stats: solver_stats or None
+        """
+        return self.stats
+
+
+_worker_shm = None  # Shared memory block attached by a worker process
+_worker_solver = None  # Solver instance of a worker process working on the shared distance matrix
+
+
+def _init_worker(name: Optional[str],
+                 shape: Optional[tuple],
+                 dtype: Optional[str],
+                 settings: dict,
+                 graph: Optional[knn_graph] = None,
+                 solver: type = None):
+    """
+    Initializer of the worker processes of solvetsp._run_iterations_parallel. Attaches to the shared memory block
+    holding the distance matrix and sets up a solver working on it without copying. If a knn_graph is given, the
+    solver works on the graph instead.
+    :param name: str
+        Name of the shared memory block
+    :param shape: tuple
+        Shape of the distance matrix
+    :param dtype: str
+        Data type of the distance matrix
+    :param settings: dict
+        Solver attributes from solvetsp._get_worker_settings
+    :param graph: knn_graph
+    :param solver: type
+        Class of the solver, solvetsp or a subclass like utils.lin_kernighan.solvelk
+    :return:
+    """
+    global _worker_shm, _worker_solver
+    solver = solver or solvetsp
+    if graph is not None:
+        _worker_solver = solver(graph)
+    else:
+        _worker_shm = shared_memory.SharedMemory(name=name)
+        _worker_solver = solver(np.ndarray(shape, dtype=np.dtype(dtype), buffer=_worker_shm.buf))
+    for key, value in settings.items():
+        setattr(_worker_solver, key, value)
+
+
+def _solve_iteration_worker(args: tuple) -> Tuple[tuple, Optional[solver_stats]]:
+    """
+    Runs one iteration of solvetsp._solve_iteration in a worker process.
+    :param args: tuple
+        Initial route (None to build a new one with solvetsp.set_init), scorethresh, the seed for the random module and
+        the deadline of all iterations (None without time limit)
+    :return:
+    result: tuple
+        Result of solvetsp._solve_iteration, None if the iteration starts after the deadline
+    stats: solver_stats
+        Counters and sweep times of this iteration, None if the solver collects no stats
+    """
+    init, scorethresh, seed, deadline = args
+    random.seed(seed)
+    if _worker_solver.stats is not None:
+        _worker_solver.stats = solver_stats()
+    if init is None:
+        if deadline is not None and time.monotonic() >= deadline:
+            return None, None
+        _worker_solver.set_init(rand=True)
+        init = _worker_solver.init
+    return _worker_solver._solve_iteration(init, scorethresh, deadline), _worker_solver.stats
@@ -1,15 +1,15 @@
-from typing import Tuple, ClassVar, List
+from typing import Tuple, ClassVar, List, Optional
 import logging
 import os
+import webbrowser
 import numpy as np
 import pandas as pd
 
 
 try:
     from ipyleaflet import Map, Marker, MarkerCluster, Polyline
-    import webbrowser
 except ImportError:
-    logging.error("Import of ipyleaflet or webbrowser failed.")
+    logging.error("Import of ipyleaflet failed.")
 
 try:
     import plotly.graph_objects as go
@@ -18,27 +18,52 @@ except ImportError:
 
 
 class visualize_graph:
+    FRAME_STEPS = ("accepted", "all")
+
     def __init__(self,
                  tspsolver: ClassVar,
-                 dataframe: pd.DataFrame):
+                 dataframe: pd.DataFrame,
+                 max_frames: Optional[int] = 200,
+                 frame_steps: str = "accepted"):
         """
         This class visualizes the algorithm steps using the plotly library.
 
-        :param tspsolver: class from utils.tsp to gather the needed data
+        :param tspsolver: class from utils.tsp to gather the needed data (or anything with get_result and
+            get_best_history, like utils.export.solver_result)
         :param dataframe: Dataframe which contains the city information
+        :param max_frames: int
+            Maximum number of frames of the animation. If more steps are recorded, they are sampled evenly, so the
+            size of the html-file is bounded independent of the instance size. All steps are shown if not set.
+        :param frame_steps: str
+            Recorded steps shown as frames: "accepted" for the accepted moves only, "all" for the sampled candidate
+            moves too (see the history level "sampled")
         """
+        if frame_steps not in self.FRAME_STEPS:
+            raise ValueError("Unknown frame steps {f}, choose from {o}".format(f=frame_steps,
+                                                                             o=list(self.FRAME_STEPS)))
         self.dataframe = dataframe
         self.best_sequence, self.best_dist = tspsolver.get_result()
-        self.all_dists, self.all_sequences = tspsolver.get_best_sequences()
+        self.history = tspsolver.get_best_history()  # Recorded moves of the best iteration, replayed into frames
+        self.steps = self._select_steps(max_frames, frame_steps)  # Recorded steps shown before the best sequence
+        self.num_frames = len(self.steps) + 1
 
         self.fig = None
 
         print("Graph Visualization selected.")
 
-    def visualize_sequences_in_graph(self):
+    def visualize_sequences_in_graph(self,
+                                     fname: str = "utils/tmp/graph.html",
+                                     open_browser: bool = True) -> str:
         """
-        This function starts the visualization of the algorithm steps.
+        This function starts the visualization of the algorithm steps. The figure is serialized once into the
+        html-file, which is then opened in the webbrowser.
+        :param fname: str
+            Path of the html-file
+        :param open_browser: bool
+            Open the html-file in the default webbrowser
         :return:
+        realpath: str
+            Absolute path of the html-file
         """
         locationmode = 'USA-states'
 
@@ -54,40 +79,58 @@ class visualize_graph:
         self._setup_cities(locationmode, color_cities)
         self._setup_layout(color_countries)
 
-        # Show interactive graph:
-        self.fig.show()
-
-        # Save interactive graph as html:
-        fname = "utils/tmp/graph.html"
+        # Save interactive graph as html and show it:
         realpath = os.path.realpath(fname)
         self.fig.write_html(realpath,
                             animation_opts={"frame": {"duration": 20}},
                             auto_play=False)
-
-        print("...Opening interactive graph in browser. If browser does not show the map correctly, try opening the "
-              "saved HTML-file ({n}) manually.".format(n=realpath))
+        if open_browser:
+            webbrowser.open_new_tab("file://" + realpath)
+            print("...Opening interactive graph in browser. If browser does not show the map correctly, try opening "
+                  "the saved HTML-file ({n}) manually.".format(n=realpath))
+        return realpath
+
+    def _select_steps(self,
+                      max_frames: Optional[int],
+                      frame_steps: str) -> np.ndarray:
+        """
+        Internal function selecting the recorded steps which are shown as frames: the accepted (or all) steps, sampled
+        evenly down to max_frames - 1 steps, as the last frame shows the best sequence.
+        :param max_frames: int
+        :param frame_steps: str
+        :return:
+        steps: array [int]
+        """
+        if self.history is None:
+            return np.empty(0, dtype=np.intp)
+        accepted = self.history.get_accepted()
+        steps = np.flatnonzero(accepted) if frame_steps == "accepted" else np.arange(len(accepted))
+        if max_frames and len(steps) > max_frames - 1:
+            steps = steps[np.unique(np.linspace(0, len(steps) - 1, max(max_frames - 1, 0)).round().astype(np.intp))]
+        logging.debug("Showing {s} of {n} recorded steps".format(s=len(steps), n=len(accepted)))
+        return steps
 
     def _setup_frames(self,
                       color_countries: int,
                       color_lines: str) -> Tuple[List[go.Frame], list, list, dict]:
 
 
+        # Replay the selected steps, followed by the best sequence, and gather the coordinates of all frames at once:
+        sequences = [seq for seq, dist in self.history.replay(self.steps)] if len(self.steps) else []
+        sequences = np.array(sequences + [self.best_sequence], dtype=np.intp)
+        lon = self.dataframe["Längengrad"].to_numpy(dtype=np.float64)[sequences]
+        lat = self.dataframe["Breitengrad"].to_numpy(dtype=np.float64)[sequences]
+        labels = self.steps.tolist() + [len(self.history) if self.history is not None else 0]
+
         # Create frames for visualization:
         frames = list()
-        self.all_sequences.append(self.best_sequence)
-        self.all_dists.append(self.best_dist)
-
-        for i in range(0,len(self.all_sequences),1):
-            seq = self.all_sequences[i]
+        for i in range(len(sequences)):
             # Calculate color for current frame:
-            color = int(color_countries + i / len(self.all_sequences) * (255.0 - color_countries))
+            color = int(color_countries + i / self.num_frames * (255.0 - color_countries))
 
-            # Store all coordinates of the cities for the current frame in correct order:
-            lon_vals = []
-            lat_vals = []
-            for s in seq:
-                lon_vals.append(self.dataframe["Längengrad"][s])
-                lat_vals.append(self.dataframe["Breitengrad"][s])
+            # Coordinates of the cities for the current frame in correct order:
+            lon_vals = lon[i].tolist()
+            lat_vals = lat[i].tolist()
 
             # Append current frame with all lines connection the cities:
             frames.append(
@@ -106,7 +149,7 @@ class visualize_graph:
                         ),
                         annotations=[
                             go.layout.Annotation(
-                                text="Step {i}".format(i=i),
+                                text="Step {i}".format(i=labels[i]),
                                 align='left',
                                 showarrow=False,
                                 xref='paper',
@@ -169,7 +212,7 @@ class visualize_graph:
                         dict(
                             label="Result",
                             method="animate",
-                            args=[[str(len(self.all_sequences)-1)], {"frame": {"duration": 99999999},
+                            args=[[str(self.num_frames - 1)], {"frame": {"duration": 99999999},
                                          "mode": "immediate"}]
                         )
                         
@@ -286,11 +329,19 @@ class visualize_map:
         print("Streetmap Visualization selected.")
 
     def visualize_sequence_on_map(self,
-                                  sequence: list):
+                                  sequence: list,
+                                  fname: str = "utils/tmp/map.html",
+                                  open_browser: bool = True) -> str:
         """
         Visualizes the resulting sequence of cities on a open source map.
         :param sequence: list [int]
+        :param fname: str
+            Path of the html-file
+        :param open_browser: bool
+            Open the html-file in the default webbrowser
         :return:
+        realpath: str
+            Absolute path of the html-file
         """
 
         self.sequence = sequence
@@ -312,14 +363,13 @@ class visualize_map:
         m.layout.width = '100vw'
         m.layout.height = '100vh'
         # Save file and show in webbrowser:
-        fname = "utils/tmp/map.html"
         realpath = os.path.realpath(fname)
-        m.save(fname)
-        # webbrowser.open_new_tab(fname)
-        webbrowser.open_new_tab("file://" + realpath)
-
-        print("...Opening interactive streetmap in browser. If browser does not show the map correctly, try opening "
-              "the saved HTML-file ({n}) manually.".format(n=realpath))
+        m.save(realpath)
+        if open_browser:
+            webbrowser.open_new_tab("file://" + realpath)
+            print("...Opening interactive streetmap in browser. If browser does not show the map correctly, try "
+                  "opening the saved HTML-file ({n}) manually.".format(n=realpath))
+        return realpath
 
 
 